@@ -0,0 +1,58 @@
+"""
+    Per-request routing cost: the linear can_handle scan of the SDK's GenericRequestMapper
+    versus the DispatchTable, for every intent of the en-US interaction model plus the
+    launch and session ended requests.
+
+    Usage: python benchmarks/bench_dispatch.py [iterations]
+"""
+import json
+import os
+import sys
+
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_runtime.dispatch_components import GenericRequestMapper
+
+from common import LAMBDA_DIR, install_config, per_call
+from envelopes import intent_request, launch_request, session_ended_request
+
+install_config()
+import lambda_function  # noqa: E402
+
+MANIFEST = os.path.join(os.path.dirname(LAMBDA_DIR), 'skill-manifests', 'locale_en_us.json')
+
+
+def requests():
+    """(label, envelope) for every request type and en-US intent the skill receives."""
+    with open(MANIFEST, encoding='utf-8') as manifest:
+        intents = json.load(manifest)['interactionModel']['languageModel']['intents']
+    yield 'LaunchRequest', launch_request()
+    for intent in intents:
+        yield intent['name'], intent_request(intent['name'])
+    yield 'SessionEndedRequest', session_ended_request()
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chains = lambda_function.sb.skill_configuration.request_mappers[0].request_handler_chains
+    linear = GenericRequestMapper(chains)
+    table = lambda_function.DispatchTable(chains)
+    serializer = DefaultSerializer()
+
+    print(f'{"request":<28}{"handler":<28}{"linear (us)":>12}{"table (us)":>12}{"speedup":>10}')
+    for label, request in requests():
+        handler_input = HandlerInput(
+            request_envelope=serializer.deserialize(json.dumps(request), RequestEnvelope))
+        expected = linear.get_request_handler_chain(handler_input)
+        assert table.get_request_handler_chain(handler_input) is expected, label
+
+        linear_time = per_call(lambda: linear.get_request_handler_chain(handler_input), number)
+        table_time = per_call(lambda: table.get_request_handler_chain(handler_input), number)
+        handler = type(expected.request_handler).__name__
+        print(f'{label:<28}{handler:<28}{linear_time:>12.2f}{table_time:>12.2f}'
+              f'{linear_time / table_time:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+    Per-request JSON cost on realistic payloads: the previous path (decode the body to
+    str, json.loads it, json.loads the notification inside, json.dumps then encode
+    events, json.dumps the Lambda event for the SDK to json.loads back) versus the JSON
+    codec of the skill, which uses orjson when it is installed.
+
+    The codec also checks every queued notification and reads its expiry date, which the
+    previous path left to each request. With the standard json module this makes queue
+    decoding about half as fast, install requirements-orjson.txt to get it back.
+
+    Usage: python benchmarks/bench_json.py [iterations]
+"""
+import json
+import sys
+
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_model import RequestEnvelope
+
+from common import install_config, per_call
+from envelopes import intent_request
+from fake_home_assistant import queue_state, state_for
+
+install_config()
+import lambda_function  # noqa: E402
+
+
+def legacy_notification(data: bytes) -> dict:
+    state = json.loads(data.decode('utf-8'))['state']
+    return lambda_function.Notification.from_home_assistant(json.loads(state))
+
+
+def codec_notification(data: bytes) -> dict:
+    return lambda_function.decode_notification(lambda_function.json_loads(data))
+
+
+def legacy_queue(data: bytes) -> list:
+    return (json.loads(data.decode('utf-8')).get('attributes') or {}).get('notifications') or []
+
+
+def codec_queue(data: bytes) -> list:
+    return lambda_function.queued_notifications(lambda_function.json_loads(data))
+
+
+def queue_of(size: int) -> bytes:
+    return json.dumps(queue_state([
+        {"event": f"event-{i}",
+         "text": f"Should I start the program number {i} of the washing machine?",
+         "confirmation_text": "Start it with <response>?", "response_text": "Starting <response>",
+         "device_id": f"amzn1.ask.device.{i:040d}", "expires": "2030-01-01T00:00:00+00:00"}
+        for i in range(size)
+    ])).encode('utf-8')
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    library = 'orjson' if lambda_function.orjson is not None else 'json'
+    event = {"event_id": "event-benchmark", "event_response": "ResponseYes",
+             "event_response_type": "ResponseYes",
+             "event_person_id": "amzn1.ask.person." + "A" * 60}
+    envelope = intent_request('Select', {'Selections': ('the blue one', 'blue')})
+    default_serializer = DefaultSerializer()
+    serializer = lambda_function.ResponseSerializer()
+
+    cases = [
+        ('input_text state', lambda data: legacy_notification(data), codec_notification,
+         json.dumps(state_for('benchmark')).encode('utf-8')),
+        ('queue of 10', legacy_queue, codec_queue, queue_of(10)),
+        ('queue of 100', legacy_queue, codec_queue, queue_of(100)),
+        ('event post', lambda data: json.dumps(data).encode('utf-8'),
+         lambda_function.json_dumps, event),
+        ('Alexa envelope',
+         lambda data: default_serializer.deserialize(json.dumps(data), RequestEnvelope),
+         lambda data: serializer.deserialize(data, RequestEnvelope), envelope),
+    ]
+
+    print(f'codec: {library}')
+    print(f'{"payload":<18}{"bytes":>8}{"legacy (us)":>14}{"codec (us)":>13}{"speedup":>10}')
+    for name, legacy, codec, payload in cases:
+        size = len(payload) if isinstance(payload, bytes) else len(json.dumps(payload))
+        legacy_time = per_call(lambda: legacy(payload), number)
+        codec_time = per_call(lambda: codec(payload), number)
+        print(f'{name:<18}{size:>8}{legacy_time:>14.2f}{codec_time:>13.2f}'
+              f'{legacy_time / codec_time:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+    Per-request cost of LocalizationInterceptor: re-reading language_strings.json
+    on every request versus the table preloaded at import time.
+
+    Usage: python benchmarks/bench_localization.py [iterations]
+"""
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+from common import LAMBDA_DIR, install_config, per_call
+
+install_config()
+import lambda_function  # noqa: E402
+
+
+def legacy_process(handler_input):
+    """LocalizationInterceptor.process as it was before the strings were preloaded."""
+    locale = handler_input.request_envelope.request.locale
+    path = os.path.join(LAMBDA_DIR, 'language_strings.json')
+    with open(path, encoding='utf-8') as language_prompts:
+        language_data = json.load(language_prompts)
+    data = language_data[locale[:2]]
+    if locale in language_data:
+        data.update(language_data[locale])
+    handler_input.attributes_manager.request_attributes["_"] = data
+
+
+def make_handler_input(locale):
+    return SimpleNamespace(
+        request_envelope=SimpleNamespace(request=SimpleNamespace(locale=locale)),
+        attributes_manager=SimpleNamespace(request_attributes={})
+    )
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    lambda_function.logger.disabled = True
+    interceptor = lambda_function.LocalizationInterceptor()
+
+    print(f'{"locale":<8}{"legacy (us)":>14}{"preloaded (us)":>16}{"speedup":>10}')
+    for locale in ('en-US', 'de-DE', 'fr-CA', 'it-IT', 'pt-BR'):
+        handler_input = make_handler_input(locale)
+        legacy = per_call(lambda: legacy_process(handler_input), number)
+        preloaded = per_call(lambda: interceptor.process(handler_input), number)
+        print(f'{locale:<8}{legacy:>14.2f}{preloaded:>16.2f}{legacy / preloaded:>9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+    Per-call cost of a debug record like the handlers log: logger.debug with an f-string
+    as the skill used to, with DEBUG off and on, versus debug() with no DebugLog, buffering
+    into the DebugLog of the invocation, and in a sampled invocation. Records are written
+    to os.devnull.
+
+    Usage: python benchmarks/bench_logging.py [iterations]
+"""
+import logging
+import os
+import sys
+
+from common import install_config, per_call
+
+install_config()
+import lambda_function  # noqa: E402
+
+STATE = {"event_id": "event-benchmark", "text": "Should I start the washing machine?",
+         "confirmation_text": None, "response_text": "Starting <response>"}
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    logger = lambda_function.logger
+    devnull = open(os.devnull, 'w')
+    for handler in logger.handlers:
+        handler.setStream(devnull)
+
+    def legacy():
+        logger.debug(f'Home Assistant state: {STATE}')
+
+    def lazy():
+        lambda_function.debug('Home Assistant state: %r', STATE)
+
+    cases = [
+        ('f-string, DEBUG off', logging.INFO, None, legacy),
+        ('f-string, DEBUG on', logging.DEBUG, None, legacy),
+        ('debug(), no DebugLog', logging.INFO, None, lazy),
+        ('debug(), buffered', logging.INFO, lambda_function.DebugLog(50), lazy),
+        ('debug(), sampled', logging.INFO, lambda_function.DebugLog(50, sampled=True), lazy),
+    ]
+
+    print(f'{"record":<24}{"per call (us)":>14}')
+    for name, level, debug_log, func in cases:
+        logger.setLevel(level)
+        lambda_function.DEBUG_LOG.set(debug_log)
+        print(f'{name:<24}{per_call(func, number):>14.2f}')
+
+    debug_log = lambda_function.DebugLog(50)
+    records = [('Home Assistant state: %r', (STATE,))] * 50
+
+    def flush():
+        debug_log.records.extend(records)
+        debug_log.flush('Benchmark')
+
+    print(f'{"flush of 50 records":<24}{per_call(flush, 1000):>14.2f}')
+    devnull.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+    Memory footprint of the notification state: a Notification record versus the five-key
+    dict the skill used to build per request, then the memory each invocation allocates
+    (tracemalloc peak and blocks left behind) for the launch and answer requests, against
+    a local stand-in Home Assistant, and the peak resident memory of the process.
+
+    Usage: python benchmarks/bench_memory.py [invocations]
+"""
+import gc
+import sys
+import tracemalloc
+
+from common import install_config, per_call
+from envelopes import intent_request, launch_request
+from fake_home_assistant import FakeHomeAssistant
+
+NOTIFICATION = {"event": "event-benchmark", "text": "Should I start the washing machine?",
+                "confirmation_text": "Start it with <response>?",
+                "response_text": "Starting <response>"}
+
+
+def state_dict(notification: dict) -> dict:
+    """The state as the skill built it before Notification."""
+    return {
+        "error": False,
+        "event_id": notification.get('event'),
+        "text": notification.get('text'),
+        "confirmation_text": notification.get('confirmation_text'),
+        "response_text": notification.get('response_text')
+    }
+
+
+def allocated(func, number: int) -> float:
+    """Bytes still allocated per object after keeping number results of func."""
+    gc.collect()
+    tracemalloc.start()
+    kept = [func() for _ in range(number)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / number
+
+
+def invocation_memory(lambda_function, event_for, number: int) -> tuple:
+    """(peak bytes of one invocation, bytes left allocated per invocation)."""
+    lambda_function.lambda_handler(event_for(), None)
+    gc.collect()
+    tracemalloc.start()
+    peak = 0
+    for _ in range(number):
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        lambda_function.lambda_handler(event_for(), None)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return peak, retained / number
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    home_assistant = FakeHomeAssistant().start()
+    install_config(HOME_ASSISTANT_URL=home_assistant.url)
+    import lambda_function
+    lambda_function.logger.disabled = True
+    Notification = lambda_function.Notification
+
+    print(f'{"state":<14}{"bytes":>8}{"build (us)":>12}')
+    for name, build in (('dict', lambda: state_dict(NOTIFICATION)),
+                        ('Notification', lambda: Notification.from_home_assistant(NOTIFICATION))):
+        print(f'{name:<14}{allocated(build, 10000):>8.0f}{per_call(build, 100000):>12.2f}')
+
+    session = {"haState": Notification.from_home_assistant(NOTIFICATION).to_session()}
+    print()
+    print(f'{"invocation":<14}{"peak (KiB)":>12}{"retained (B)":>14}')
+    def yes_request():
+        return intent_request('AMAZON.YesIntent', session_attributes=dict(session))
+
+    for name, event_for in (('launch', launch_request), ('yes', yes_request)):
+        peak, retained = invocation_memory(lambda_function, event_for, number)
+        print(f'{name:<14}{peak / 1024:>12.1f}{retained:>14.0f}')
+
+    print()
+    print(f'max resident memory: {lambda_function.max_memory_used()} MB')
+    home_assistant.stop()
+
+
+if __name__ == '__main__':
+    main()
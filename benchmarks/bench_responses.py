@@ -0,0 +1,66 @@
+"""
+    Per-request cost of building and serializing the response of the handlers answering
+    with fixed text: a fresh response serialized by the SDK's DefaultSerializer, versus
+    the StaticResponses reused with their serialized form by the ResponseSerializer.
+
+    Usage: python benchmarks/bench_responses.py [iterations]
+"""
+import sys
+
+from ask_sdk_core.response_helper import ResponseFactory
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_model import ResponseEnvelope
+
+from common import install_config, per_call
+
+install_config()
+import lambda_function  # noqa: E402
+
+STRINGS = lambda_function.get_language_strings('en-US')
+SESSION_ATTRIBUTES = {"haState": {"event_id": "event", "text": "Question?",
+                                  "confirmation_text": None, "response_text": None}}
+
+# handler, speech, reprompt
+CASES = [
+    ('CancelOrStopIntentHandler', STRINGS['STOP_MESSAGE'], None),
+    ('DateTimeIntentHandler', STRINGS['ERROR_SPECIFIC_DATE'], ''),
+    ('LaunchRequestHandler', STRINGS['NO_NOTIFICATION'], None),
+    ('LaunchRequestHandler (401)', 'Error 401 ' + STRINGS['ERROR_401'], None),
+    ('CatchAllExceptionHandler', STRINGS['ERROR_CONFIG'], None),
+]
+
+
+def envelope(response) -> ResponseEnvelope:
+    return ResponseEnvelope(response=response, version='1.0', session_attributes=SESSION_ATTRIBUTES,
+                            user_agent='ask-python/1.11.0 Python/3')
+
+
+def fresh(serializer, speech, reprompt):
+    builder = ResponseFactory().speak(speech)
+    if reprompt is not None:
+        builder.ask(reprompt)
+    return serializer.serialize(envelope(builder.response))
+
+
+def static(serializer, speech, reprompt):
+    return serializer.serialize(envelope(lambda_function.STATIC_RESPONSES.get(speech, reprompt)))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    default_serializer = DefaultSerializer()
+    response_serializer = lambda_function.ResponseSerializer()
+
+    print(f'{"handler":<30}{"fresh (us)":>12}{"static (us)":>13}{"speedup":>10}')
+    for handler, speech, reprompt in CASES:
+        expected = fresh(default_serializer, speech, reprompt)
+        assert static(response_serializer, speech, reprompt) == expected, handler
+
+        fresh_time = per_call(lambda: fresh(default_serializer, speech, reprompt), number)
+        static_time = per_call(lambda: static(response_serializer, speech, reprompt), number)
+        print(f'{handler:<30}{fresh_time:>12.2f}{static_time:>13.2f}'
+              f'{fresh_time / static_time:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
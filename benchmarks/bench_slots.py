@@ -0,0 +1,58 @@
+"""
+    Per-request cost of reading the Durations slot of the Duration intent: isodate, as the
+    handler used, versus the duration_seconds fast path, then both for common durations.
+    The other answer intents read their slots with get_slot_value, as they always did.
+
+    Usage: python benchmarks/bench_slots.py [iterations]
+"""
+import json
+import sys
+
+from ask_sdk_core.attributes_manager import AttributesManager
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_core.utils import get_slot_value
+from ask_sdk_model import RequestEnvelope
+
+from common import install_config, per_call
+from envelopes import intent_request
+
+install_config()
+import isodate  # noqa: E402
+import lambda_function  # noqa: E402
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    serializer = DefaultSerializer()
+    request_envelope = serializer.deserialize(
+        json.dumps(intent_request('Duration', {'Durations': ('PT1H30M',)})), RequestEnvelope)
+    attributes_manager = AttributesManager(request_envelope=request_envelope)
+    handler_input = HandlerInput(request_envelope=request_envelope,
+                                 attributes_manager=attributes_manager)
+
+    def legacy():
+        return isodate.parse_duration(get_slot_value(handler_input, 'Durations')).total_seconds()
+
+    def fast():
+        return lambda_function.duration_seconds(get_slot_value(handler_input, 'Durations'))
+
+    assert legacy() == fast()
+    legacy_time = per_call(legacy, number)
+    fast_time = per_call(fast, number)
+    print(f'{"intent":<10}{"isodate (us)":>14}{"fast path (us)":>16}{"speedup":>10}')
+    print(f'{"Duration":<10}{legacy_time:>14.2f}{fast_time:>16.2f}'
+          f'{legacy_time / fast_time:>9.1f}x')
+
+    print()
+    print(f'{"duration":<16}{"isodate (us)":>14}{"fast path (us)":>16}')
+    for duration in ('PT10M', 'PT1H30M', 'P2D', 'P1W', 'P1Y2M'):
+        expected = isodate.parse_duration(duration).total_seconds()
+        assert expected == lambda_function.duration_seconds(duration)
+        slow = per_call(lambda: isodate.parse_duration(duration).total_seconds(), number)
+        fast = per_call(lambda: lambda_function.duration_seconds(duration), number)
+        print(f'{duration:<16}{slow:>14.2f}{fast:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+    Cold start benchmark: imports lambda_function and serves a first LaunchRequest in
+    fresh interpreters, against a local stand-in Home Assistant, and reports the
+    import time, first request time and the import cost of each dependency. With
+    --warm-up, a keep-warm event is handled before the first request.
+
+    Usage: python benchmarks/cold_start.py [runs] [--warm-up]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from fake_home_assistant import FakeHomeAssistant
+
+
+def child(url: str, warm: bool = False):
+    """Runs in the fresh interpreter, prints its timings as JSON."""
+    from common import install_config
+    from envelopes import launch_request
+
+    install_config(HOME_ASSISTANT_URL=url)
+    start = time.perf_counter()
+    import lambda_function
+    imported = time.perf_counter()
+    lambda_function.logger.disabled = True
+    if warm:
+        scheduled_event = {"source": "aws.events", "detail-type": "Scheduled Event"}
+        lambda_function.lambda_handler(scheduled_event, None)
+    warmed = time.perf_counter()
+    lambda_function.lambda_handler(launch_request(), None)
+    done = time.perf_counter()
+
+    print(json.dumps({
+        "import": imported - start,
+        "warm_up": warmed - imported,
+        "first_request": done - warmed,
+        "modules": lambda_function.IMPORT_TIMES
+    }))
+
+
+def summary(values):
+    values = [value * 1000 for value in values]
+    return (f'median {statistics.median(values):7.1f}ms  '
+            f'min {min(values):7.1f}ms  max {max(values):7.1f}ms')
+
+
+def main():
+    arguments = [argument for argument in sys.argv[1:] if argument != '--warm-up']
+    warm = '--warm-up' in sys.argv
+    runs = int(arguments[0]) if arguments else 10
+    home_assistant = FakeHomeAssistant().start()
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c',
+             f'import cold_start; cold_start.child({home_assistant.url!r}, {warm})'],
+            cwd=here, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    home_assistant.stop()
+
+    print(f'{runs} cold starts')
+    print(f'{"import":<20}{summary([result["import"] for result in results])}')
+    if warm:
+        print(f'{"warm up":<20}{summary([result["warm_up"] for result in results])}')
+    print(f'{"first request":<20}{summary([result["first_request"] for result in results])}')
+    for module in results[0]['modules']:
+        print(f'{"  " + module:<20}{summary([result["modules"][module] for result in results])}')
+
+
+if __name__ == '__main__':
+    main()
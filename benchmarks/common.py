@@ -0,0 +1,34 @@
+"""Shared setup for the benchmark scripts, run them from the repository root."""
+import os
+import sys
+import time
+import types
+from typing import Callable
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda')
+sys.path.insert(0, LAMBDA_DIR)
+
+
+def install_config(**overrides) -> types.ModuleType:
+    """
+        Provide the config module the skill imports, so benchmarks never
+        depend on (or talk to the Home Assistant in) a local config.py.
+    """
+
+    config = types.ModuleType('config')
+    config.HOME_ASSISTANT_URL = 'http://127.0.0.1:8123'
+    config.VERIFY_SSL = False
+    config.TOKEN = 'benchmark'
+    config.DEBUG = False
+    vars(config).update(overrides)
+    sys.modules['config'] = config
+    return config
+
+
+def per_call(func: Callable[[], object], number: int) -> float:
+    """Return the average wall time of one call to func, in microseconds."""
+    func()
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
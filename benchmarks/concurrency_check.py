@@ -0,0 +1,68 @@
+"""
+    Fires interleaved Alexa requests from many users through lambda_handler on a
+    thread pool and checks that no request sees another request's state or token.
+
+    Every user has its own access token, and the stand-in Home Assistant serves each
+    token its own notification, so any bleed shows up as a foreign event_id or text.
+
+    Usage: python benchmarks/concurrency_check.py [requests] [threads] [rest|websocket]
+"""
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from common import install_config
+from envelopes import intent_request, launch_request, session_ended_request
+from fake_home_assistant import FakeHomeAssistant, notification_for
+
+home_assistant = FakeHomeAssistant().start()
+install_config(HOME_ASSISTANT_URL=home_assistant.url, TOKEN='',
+               HA_TRANSPORT=sys.argv[3] if len(sys.argv) > 3 else 'rest')
+import lambda_function  # noqa: E402
+
+REQUESTS = [
+    (launch_request, (), lambda token: notification_for(token)['text']),
+    (intent_request, ('AMAZON.YesIntent',), lambda token: f'Answer from {token} is ResponseYes'),
+    (intent_request, ('AMAZON.NoIntent',), lambda token: f'Answer from {token} is ResponseNo'),
+    (intent_request, ('Number', {'Numbers': ('42',)}), lambda token: f'Answer from {token} is 42'),
+    (intent_request, ('String', {'Strings': ('hello',)}),
+     lambda token: f'Answer from {token} is hello'),
+    (intent_request, ('Date', {'Dates': (None,)}),
+     lambda token: f"Sorry I did not catch that... <break time='200ms'/> "
+                   f"{notification_for(token)['text']}"),
+    (session_ended_request, ('EXCEEDED_MAX_REPROMPTS',), lambda token: None),
+]
+
+
+def run(index: int):
+    build, args, expected = random.choice(REQUESTS)
+    token = f'token{index}'
+    event = build(*args, user_id=f'user{index}', access_token=token)
+    response = lambda_function.lambda_handler(event, None)
+    speech = response['response'].get('outputSpeech')
+    actual = speech['ssml'][len('<speak>'):-len('</speak>')] if speech else None
+    return token, expected(token), actual
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    lambda_function.logger.disabled = True
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(run, range(total)))
+
+    failures = [result for result in results if result[1] != result[2]]
+    failures += [(event['token'], event['event_id'], None) for event in home_assistant.events
+                 if event['event_id'] != notification_for(event['token'])['event']]
+    home_assistant.stop()
+
+    for token, expected, actual in failures[:10]:
+        print(f'{token}: expected {expected!r}, got {actual!r}')
+    print(f'{total} requests on {threads} threads over {lambda_function.HA_TRANSPORT}, '
+          f'{len(home_assistant.events)} events, {len(failures)} with state from another request')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""Builders for the Alexa request envelopes the skill receives."""
+import uuid
+from typing import Optional
+
+
+def envelope(request: dict, locale: str = 'en-US', user_id: str = 'user',
+             access_token: Optional[str] = None, session_attributes: Optional[dict] = None,
+             new_session: bool = False) -> dict:
+    request = dict({
+        "requestId": f"amzn1.echo-api.request.{uuid.uuid4()}",
+        "timestamp": "2021-01-01T00:00:00Z",
+        "locale": locale
+    }, **request)
+    user = {"userId": user_id}
+    if access_token:
+        user["accessToken"] = access_token
+    application = {"applicationId": "amzn1.ask.skill.benchmark"}
+    return {
+        "version": "1.0",
+        "session": {
+            "new": new_session,
+            "sessionId": f"amzn1.echo-api.session.{user_id}",
+            "application": application,
+            "attributes": session_attributes or {},
+            "user": user
+        },
+        "context": {
+            "System": {
+                "application": application,
+                "user": user,
+                "device": {"deviceId": f"device-{user_id}", "supportedInterfaces": {}},
+                "apiEndpoint": "https://api.amazonalexa.com"
+            }
+        },
+        "request": request
+    }
+
+
+def launch_request(**kwargs) -> dict:
+    return envelope({"type": "LaunchRequest"}, new_session=True, **kwargs)
+
+
+def session_ended_request(reason: str = 'USER_INITIATED', **kwargs) -> dict:
+    return envelope({"type": "SessionEndedRequest", "reason": reason}, **kwargs)
+
+
+def slot(name: str, value: Optional[str], resolved: Optional[str] = None) -> dict:
+    slot_data = {"name": name, "value": value, "confirmationStatus": "NONE"}
+    if resolved:
+        slot_data["resolutions"] = {"resolutionsPerAuthority": [{
+            "authority": f"amzn1.er-authority.echo-sdk.{name}",
+            "status": {"code": "ER_SUCCESS_MATCH"},
+            "values": [{"value": {"name": resolved, "id": resolved.upper()}}]
+        }]}
+    return slot_data
+
+
+def intent_request(name: str, slots: Optional[dict] = None, **kwargs) -> dict:
+    return envelope({
+        "type": "IntentRequest",
+        "intent": {
+            "name": name,
+            "confirmationStatus": "NONE",
+            "slots": {slot_name: slot(slot_name, *value)
+                      for slot_name, value in (slots or {}).items()}
+        }
+    }, **kwargs)
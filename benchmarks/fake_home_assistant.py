@@ -0,0 +1,231 @@
+"""
+    Local stand-in for the parts of the Home Assistant REST and websocket APIs the skill
+    uses: reading the actionable notification entity and firing the answer event.
+"""
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import common  # noqa: F401, puts the skill on the path
+from ha_websocket import (OPCODE_CLOSE, OPCODE_TEXT, WebSocketError, accept_key, encode_frame,
+                          read_frame)
+
+INPUT_TEXT_ENTITY = 'input_text.alexa_actionable_notification'
+QUEUE_ENTITY = 'sensor.alexa_actionable_notifications'
+QUEUE_PATH = f'/api/states/{QUEUE_ENTITY}'
+WEBSOCKET_PATH = '/api/websocket'
+INPUT_TEXT_PATH = '/api/states/input_text.alexa_actionable_notification'
+EVENT_PATH = '/api/events/alexa_actionable_notification'
+BATCH_EVENT_PATH = '/api/events/alexa_actionable_notification_batch'
+
+
+def state_for(token: str) -> dict:
+    """The notification entity as Home Assistant serves it to a bearer token."""
+    return {
+        "entity_id": INPUT_TEXT_ENTITY,
+        "state": json.dumps(notification_for(token)),
+        "attributes": {},
+        "last_changed": "2021-01-01T00:00:00+00:00",
+        "last_updated": "2021-01-01T00:00:00+00:00",
+        # Every state write gets its own context, here every token its own notification
+        "context": {"id": f"context-{token}"}
+    }
+
+
+def queue_state(notifications: list) -> dict:
+    """The notification queue entity, see NotificationQueue in the skill."""
+    return {
+        "entity_id": QUEUE_ENTITY,
+        "state": str(len(notifications)),
+        "attributes": {"notifications": notifications},
+        "last_changed": "2021-01-01T00:00:00+00:00",
+        "last_updated": "2021-01-01T00:00:00+00:00",
+        "context": {"id": "queue-" + ",".join(str(notification.get('event'))
+                                              for notification in notifications)}
+    }
+
+
+def notification_for(token: str) -> dict:
+    """The notification served to a bearer token, unique per token so answers can be traced."""
+    return {
+        "event": f"event-{token}",
+        "text": f"Question for {token}?",
+        "confirmation_text": None,
+        "response_text": f"Answer from {token} is <response>"
+    }
+
+
+class FakeHomeAssistant(ThreadingHTTPServer):
+    """
+        Threaded HTTP server recording every event it receives.
+
+        :param latency: Seconds to wait before answering each request.
+        :param error_rate: Share of requests, between 0 and 1, answered with error_status.
+        :param error_status: HTTP status of the injected errors.
+
+        The notifications in the queue attribute are served from the queue entity, and the
+        ones answered by an event are removed from it.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 500):
+        super().__init__(('127.0.0.1', port), _RequestHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.events = []
+        self.queue = []
+        self.requests = 0
+        self.websocket_connections = 0
+        self._websockets = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def handle_error(self, request, client_address):
+        # Clients timing out on injected latency hang up before the answer, that's expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def start(self) -> 'FakeHomeAssistant':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def drop_websockets(self) -> None:
+        """Cut every open websocket connection, as a restarting Home Assistant would."""
+        with self._lock:
+            for connection in self._websockets:
+                connection.shutdown(socket.SHUT_RDWR)
+            self._websockets.clear()
+
+    def inject(self) -> Optional[int]:
+        """Apply the configured latency, and return an error status if this request should fail."""
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+    def record(self, event: Optional[dict] = None) -> None:
+        with self._lock:
+            self.requests += 1
+            if event is not None:
+                answers = [dict(answer, token=event.get('token')) for answer in event['answers']] \
+                    if 'answers' in event else [event]
+                self.events.extend(answers)
+                answered = {answer.get('event_id') for answer in answers}
+                self.queue = [notification for notification in self.queue
+                              if notification.get('event') not in answered]
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: FakeHomeAssistant
+
+    def log_message(self, format, *args):
+        pass
+
+    def _token(self) -> str:
+        return self.headers.get('Authorization', '').replace('Bearer ', '', 1)
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == WEBSOCKET_PATH and self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self._serve_websocket()
+        self.server.record()
+        error = self.server.inject()
+        if error:
+            return self._send(error, {"message": "Injected error."})
+        if self.path == QUEUE_PATH:
+            return self._send(200, queue_state(self.server.queue))
+        if self.path != INPUT_TEXT_PATH:
+            return self._send(404, {"message": "Entity not found."})
+        self._send(200, state_for(self._token()))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        error = self.server.inject()
+        if error:
+            self.server.record()
+            return self._send(error, {"message": "Injected error."})
+        if self.path not in (EVENT_PATH, BATCH_EVENT_PATH):
+            self.server.record()
+            return self._send(404, {"message": "Not found."})
+        event = json.loads(body or b'{}')
+        event['token'] = self._token()
+        self.server.record(event)
+        self._send(200, {"message": "Event alexa_actionable_notification fired."})
+
+    def _send_message(self, message: dict) -> None:
+        payload = json.dumps(message).encode('utf-8')
+        self.wfile.write(encode_frame(OPCODE_TEXT, payload, masked=False))
+
+    def _receive_message(self) -> Optional[dict]:
+        _, opcode, payload = read_frame(self.rfile)
+        return None if opcode == OPCODE_CLOSE else json.loads(payload)
+
+    def _serve_websocket(self):
+        self.close_connection = True
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept_key(self.headers['Sec-WebSocket-Key']))
+        self.end_headers()
+
+        with self.server._lock:
+            self.server.websocket_connections += 1
+            self.server._websockets.add(self.connection)
+        try:
+            self._send_message({"type": "auth_required"})
+            token = self._receive_message()['access_token']
+            self._send_message({"type": "auth_ok"})
+            while True:
+                message = self._receive_message()
+                if message is None:
+                    return
+                self._send_message(self._run_command(token, message))
+        except (OSError, WebSocketError):
+            return
+        finally:
+            with self.server._lock:
+                self.server._websockets.discard(self.connection)
+
+    def _run_command(self, token: str, message: dict) -> dict:
+        if message['type'] == 'ping':
+            return {"id": message['id'], "type": "pong"}
+        result = {"id": message['id'], "type": "result", "success": True, "result": None}
+        error = self.server.inject()
+        if error:
+            self.server.record()
+            result.update(success=False,
+                          error={"code": "unknown_error", "message": "Injected error."})
+        elif message['type'] == 'fire_event':
+            self.server.record(dict(message['event_data'], token=token))
+        else:
+            self.server.record()
+            result.update(success=False,
+                          error={"code": "unknown_command", "message": "Unknown command."})
+        return result
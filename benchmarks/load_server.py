@@ -0,0 +1,83 @@
+"""
+    Load test of the local HTTP server mode: clients on keep-alive connections POST
+    launch and answer envelopes to lambda/local_server.py, itself talking to a local
+    stand-in Home Assistant, and the latency percentiles are reported.
+
+    Usage: python benchmarks/load_server.py [--requests N] [--clients N] [--threads N]
+                                            [--latency SECONDS]
+"""
+import argparse
+import http.client
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+from common import install_config
+from envelopes import intent_request, launch_request
+from fake_home_assistant import FakeHomeAssistant
+
+
+def client(port: int, number: int, index: int) -> list:
+    """Send number requests over one connection, returns their latencies in seconds."""
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    for i in range(number):
+        token = f'client{index}'
+        request = launch_request(access_token=token, user_id=token) if i % 2 == 0 else \
+            intent_request('AMAZON.YesIntent', access_token=token, user_id=token)
+        body = json.dumps(request)
+        start = time.perf_counter()
+        connection.request('POST', '/', body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        assert response.status == 200, response.status
+    connection.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds Home Assistant takes to answer')
+    args = parser.parse_args()
+
+    home_assistant = FakeHomeAssistant(latency=args.latency)
+    home_assistant.start()
+    install_config(HOME_ASSISTANT_URL=home_assistant.url, TOKEN='')
+
+    import lambda_function
+    import local_server
+    lambda_function.logger.disabled = True
+
+    server = local_server.SkillHTTPServer(('127.0.0.1', 0), verify=False, threads=args.threads)
+    Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    per_client = args.requests // args.clients
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        per_client_latencies = pool.map(lambda i: client(port, per_client, i), range(args.clients))
+        latencies = sorted(sum(per_client_latencies, []))
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    server.server_close()
+    home_assistant.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'{len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s, '
+          f'{len(latencies) / elapsed:.0f} req/s', file=sys.stderr)
+    print(f'p50 {quantiles[49] * 1000:.2f}ms  p95 {quantiles[94] * 1000:.2f}ms  '
+          f'p99 {quantiles[98] * 1000:.2f}ms  max {latencies[-1] * 1000:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+    Serves users of many homes from one skill: every user is routed by HOME_ASSISTANT_ROUTES
+    to one of several stand-in Home Assistants, with a long lived token of their own, and
+    interleaved requests are fired from a thread pool. Checks that every answer and event
+    reached the Home Assistant of its user, and reports the latency with the Homes kept
+    open, which churns when the cache size is below the number of homes.
+
+    Usage: python benchmarks/multi_home_check.py [requests] [homes] [cache size] [threads]
+"""
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import install_config
+from envelopes import intent_request, launch_request
+from fake_home_assistant import FakeHomeAssistant, notification_for
+
+USERS_PER_HOME = 4
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    homes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    cache_size = int(sys.argv[3]) if len(sys.argv) > 3 else homes
+    threads = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+
+    home_assistants = [FakeHomeAssistant().start() for _ in range(homes)]
+    routes = {f'user{index}': {"url": home_assistants[index % homes].url, "token": f'token{index}'}
+              for index in range(homes * USERS_PER_HOME)}
+    install_config(HOME_ASSISTANT_URL='http://127.0.0.1:1', HOME_ASSISTANT_ROUTES=routes,
+                   HOME_CACHE_SIZE=cache_size)
+    import lambda_function
+    lambda_function.logger.disabled = True
+
+    def run(_):
+        index = random.randrange(len(routes))
+        token = f'token{index}'
+        if random.random() < 0.5:
+            event = launch_request(user_id=f'user{index}')
+            expected = notification_for(token)['text']
+        else:
+            state = lambda_function.Notification.from_home_assistant(notification_for(token))
+            event = intent_request('AMAZON.YesIntent', user_id=f'user{index}',
+                                   session_attributes={"haState": state.to_session()})
+            expected = f'Answer from {token} is ResponseYes'
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, None)
+        latency = time.perf_counter() - start
+        actual = response['response']['outputSpeech']['ssml'][len('<speak>'):-len('</speak>')]
+        return latency, (token, expected, actual)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(run, range(total)))
+
+    failures = [result for _, result in results if result[1] != result[2]]
+    for home, home_assistant in enumerate(home_assistants):
+        failures += [(event['token'], f'event on home {home}', event['event_id'])
+                     for event in home_assistant.events
+                     if int(event['token'][len('token'):]) % homes != home
+                     or event['event_id'] != notification_for(event['token'])['event']]
+        home_assistant.stop()
+
+    for token, expected, actual in failures[:10]:
+        print(f'{token}: expected {expected!r}, got {actual!r}')
+    quantiles = statistics.quantiles([latency for latency, _ in results], n=100)
+    print(f'{total} requests to {homes} homes, {cache_size} kept open: '
+          f'p50 {quantiles[49] * 1000:.2f}ms  p99 {quantiles[98] * 1000:.2f}ms, '
+          f'{len(failures)} reached the wrong home')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+    Replays a corpus of Alexa request envelopes through lambda_handler against a local
+    stand-in Home Assistant, and reports latency percentiles, throughput and memory
+    allocated per request, for every request in the corpus.
+
+    By default the corpus holds a LaunchRequest, every intent of every
+    skill-manifests/locale_*.json, and a SessionEndedRequest. Envelopes recorded from
+    the Alexa developer console can be replayed instead with --corpus.
+
+    Usage:
+        python benchmarks/replay.py [--iterations N] [--latency SECONDS] [--error-rate RATE]
+        python benchmarks/replay.py --record DIR      # write the default corpus as JSON
+        python benchmarks/replay.py --corpus DIR      # replay the *.json envelopes in DIR
+        python benchmarks/replay.py --save FILE       # keep the results as a baseline
+        python benchmarks/replay.py --compare FILE    # fail if p95 regressed past --threshold
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+from common import install_config
+from envelopes import intent_request, launch_request, session_ended_request
+from fake_home_assistant import FakeHomeAssistant, notification_for
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MANIFESTS_DIR = os.path.join(REPOSITORY_DIR, 'skill-manifests')
+TOKEN = 'benchmark'
+
+# Sample slot values, by slot type
+SLOT_SAMPLES = {
+    'AMAZON.SearchQuery': 'turn on the lights',
+    'AMAZON.FOUR_DIGIT_NUMBER': '42',
+    'AMAZON.DURATION': 'PT15M',
+    'AMAZON.DATE': '2021-01-01',
+    'AMAZON.TIME': '08:00',
+}
+
+
+def session_state() -> dict:
+    """Session attributes of a session opened by a LaunchRequest."""
+    notification = notification_for(TOKEN)
+    return {"haState": {
+        "event_id": notification['event'],
+        "text": notification['text'],
+        "confirmation_text": notification['confirmation_text'],
+        "response_text": notification['response_text']
+    }}
+
+
+def build_corpus() -> List[Tuple[str, dict]]:
+    """One envelope per request type and intent, for every locale with a skill manifest."""
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(MANIFESTS_DIR, 'locale_*.json'))):
+        language, region = os.path.basename(path)[len('locale_'):-len('.json')].split('_')
+        locale = f'{language}-{region.upper()}'
+        with open(path, encoding='utf-8') as manifest:
+            model = json.load(manifest)['interactionModel']['languageModel']
+        custom_values = {slot_type['name']: slot_type['values'][0]['name']['value']
+                         for slot_type in model['types']}
+
+        corpus.append((f'{locale} LaunchRequest', launch_request(locale=locale)))
+        for intent in model['intents']:
+            slots = {}
+            for slot in intent.get('slots', []):
+                if slot['type'] in custom_values:
+                    value = custom_values[slot['type']]
+                    slots[slot['name']] = (value.lower(), value)
+                else:
+                    slots[slot['name']] = (SLOT_SAMPLES.get(slot['type'], 'sample'),)
+            corpus.append((f'{locale} {intent["name"]}', intent_request(
+                intent['name'], slots, locale=locale, session_attributes=session_state())))
+        corpus.append((f'{locale} SessionEndedRequest', session_ended_request(
+            'EXCEEDED_MAX_REPROMPTS', locale=locale, session_attributes=session_state())))
+    return corpus
+
+
+def load_corpus(directory: str) -> List[Tuple[str, dict]]:
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path, encoding='utf-8') as envelope:
+            corpus.append((os.path.basename(path)[:-len('.json')], json.load(envelope)))
+    return corpus
+
+
+def record_corpus(corpus: List[Tuple[str, dict]], directory: str) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for name, envelope in corpus:
+        path = os.path.join(directory, name.replace(' ', '_') + '.json')
+        with open(path, 'w', encoding='utf-8') as output:
+            json.dump(envelope, output, indent=2)
+
+
+def percentile(values: List[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+def measure(handler, envelope: dict, iterations: int) -> Dict[str, float]:
+    """Latency and throughput of one envelope, then memory allocated on a traced run."""
+    handler(envelope, None)
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        handler(envelope, None)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    handler(envelope, None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "mean": statistics.mean(latencies) * 1000,
+        "rps": iterations / elapsed,
+        "alloc_kib": (peak - before) / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Home Assistant latency, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of failing Home Assistant requests')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--transport', choices=('rest', 'websocket'), default='rest')
+    parser.add_argument('--corpus', help='directory of recorded *.json envelopes to replay')
+    parser.add_argument('--record', help='write the default corpus to this directory and exit')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with results saved by --save')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='allowed p95 ratio for --compare')
+    parser.add_argument('--min-delta', type=float, default=0.5,
+                        help='p95 increase in ms ignored by --compare')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus()
+    if args.record:
+        record_corpus(corpus, args.record)
+        print(f'Recorded {len(corpus)} envelopes in {args.record}')
+        return 0
+
+    home_assistant = FakeHomeAssistant(latency=args.latency, error_rate=args.error_rate,
+                                       error_status=args.error_status).start()
+    install_config(HOME_ASSISTANT_URL=home_assistant.url, TOKEN=TOKEN, HA_TRANSPORT=args.transport)
+    import lambda_function
+    lambda_function.logger.disabled = True
+
+    results = {}
+    print(f'{"request":<38}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>9}{"alloc KiB":>11}')
+    for name, envelope in corpus:
+        result = results[name] = measure(lambda_function.lambda_handler, envelope, args.iterations)
+        print(f'{name:<38}{result["p50"]:>9.2f}{result["p95"]:>9.2f}{result["p99"]:>9.2f}'
+              f'{result["rps"]:>9.0f}{result["alloc_kib"]:>11.1f}')
+    home_assistant.stop()
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = [(name, baseline[name]['p95'], result['p95'])
+                       for name, result in results.items()
+                       if name in baseline
+                       and result['p95'] > baseline[name]['p95'] * args.threshold
+                       and result['p95'] - baseline[name]['p95'] > args.min_delta]
+        for name, before, after in regressions:
+            print(f'REGRESSION {name}: p95 {before:.2f}ms -> {after:.2f}ms')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+""" Minimal client for the Home Assistant websocket API, without third party dependencies. """
+import os
+import ssl
+import json
+import base64
+import socket
+import time
+import struct
+import hashlib
+import threading
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+class WebSocketError(Exception):
+    """The websocket connection failed or was closed."""
+
+
+class AuthenticationError(WebSocketError):
+    """Home Assistant rejected the access token."""
+
+
+class SendError(WebSocketError):
+    """A command could not be sent, Home Assistant never got it."""
+
+
+def accept_key(key: str) -> str:
+    """Sec-WebSocket-Accept value the server answers to a Sec-WebSocket-Key."""
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def _mask(payload: bytes, mask: bytes) -> bytes:
+    length = len(payload)
+    repeated = (mask * (length // 4 + 1))[:length]
+    masked = int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')
+    return masked.to_bytes(length, 'big')
+
+
+def encode_frame(opcode: int, payload: bytes, masked: bool) -> bytes:
+    """Encode a single final frame, clients must mask the frames they send."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, (0x80 if masked else 0) | length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, (0x80 if masked else 0) | 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, (0x80 if masked else 0) | 127, length)
+
+    if not masked:
+        return header + payload
+    mask = os.urandom(4)
+    return header + mask + _mask(payload, mask)
+
+
+def read_frame(stream) -> Tuple[bool, int, bytes]:
+    """Read one frame from a buffered binary stream, returns (fin, opcode, payload)."""
+    header = stream.read(2)
+    if len(header) < 2:
+        raise WebSocketError("Connection closed")
+
+    fin = bool(header[0] & 0x80)
+    opcode = header[0] & 0x0F
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', stream.read(8))[0]
+    mask = stream.read(4) if header[1] & 0x80 else None
+
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise WebSocketError("Connection closed")
+    return fin, opcode, _mask(payload, mask) if mask else payload
+
+
+class WebSocket:
+    """A client websocket connection exchanging text messages."""
+
+    def __init__(self, url: str, verify_ssl: bool = True, timeout: Optional[float] = None):
+        parts = urlsplit(url)
+        secure = parts.scheme in ('wss', 'https')
+        port = parts.port or (443 if secure else 80)
+
+        sock = socket.create_connection((parts.hostname, port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if secure:
+            context = ssl.create_default_context()
+            if not verify_ssl:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            sock = context.wrap_socket(sock, server_hostname=parts.hostname)
+
+        self._socket = sock
+        self._stream = sock.makefile('rb')
+        self._send_lock = threading.Lock()
+        self._handshake(parts.netloc, parts.path or '/')
+
+    def _handshake(self, host: str, path: str) -> None:
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        self._socket.sendall((
+            f'GET {path} HTTP/1.1\r\n'
+            f'Host: {host}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'
+        ).encode('ascii'))
+
+        status = self._stream.readline()
+        headers = {}
+        for line in iter(self._stream.readline, b'\r\n'):
+            if not line:
+                raise WebSocketError("Connection closed during handshake")
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if status.split()[1:2] != [b'101'] or \
+                headers.get('sec-websocket-accept') != accept_key(key):
+            raise WebSocketError(f'Websocket handshake failed: {status.decode("latin-1").strip()}')
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        self._socket.settimeout(timeout)
+
+    def send_text(self, message: str) -> None:
+        with self._send_lock:
+            self._socket.sendall(encode_frame(OPCODE_TEXT, message.encode('utf-8'), masked=True))
+
+    def recv_text(self) -> str:
+        """Read the next text message, answering pings along the way."""
+        fragments = []
+        while True:
+            fin, opcode, payload = read_frame(self._stream)
+            if opcode == OPCODE_PING:
+                with self._send_lock:
+                    self._socket.sendall(encode_frame(OPCODE_PONG, payload, masked=True))
+                continue
+            if opcode == OPCODE_CLOSE:
+                raise WebSocketError("Connection closed by the server")
+            if opcode in (OPCODE_TEXT, OPCODE_CONTINUATION):
+                fragments.append(payload)
+                if fin:
+                    return b''.join(fragments).decode('utf-8')
+
+    def close(self) -> None:
+        try:
+            with self._send_lock:
+                self._socket.sendall(encode_frame(OPCODE_CLOSE, b'', masked=True))
+        except OSError:
+            pass
+        self._stream.close()
+        self._socket.close()
+
+
+class HomeAssistantWebSocket:
+    """
+        Authenticated connection to the Home Assistant websocket API.
+
+        Commands from several threads are multiplexed over the one connection: each
+        command is sent right away, and whichever caller is waiting reads the results
+        off the socket and hands them to their caller by message id.
+
+        A command that could not be sent raises SendError, and can be sent again. Once it
+        was sent, a connection failure raises WebSocketError and a command given a timeout
+        raises TimeoutError once it is over: Home Assistant may still run it. A timeout
+        while reading the socket closes the connection, as it can stop in the middle of
+        a frame.
+    """
+
+    def __init__(self, base_url: str, token: str, verify_ssl: bool = True,
+                 timeout: Optional[float] = None):
+        url = base_url.replace('https://', 'wss://', 1).replace('http://', 'ws://', 1)
+        url += '/api/websocket'
+        self._websocket = WebSocket(url, verify_ssl=verify_ssl, timeout=timeout)
+        self._timeout = timeout
+        self._last_id = 0
+        self._id_lock = threading.Lock()
+        self._results = {}
+        self._abandoned = set()
+        self._reading = False
+        self._error: Optional[Exception] = None
+        self._condition = threading.Condition()
+        try:
+            self._authenticate(token)
+        except (ValueError, struct.error) as error:
+            self.close()
+            raise WebSocketError(f'Invalid authentication message: {error}') from error
+        self.last_used = time.monotonic()
+
+    @property
+    def closed(self) -> bool:
+        return self._error is not None
+
+    def _authenticate(self, token: str) -> None:
+        message = json.loads(self._websocket.recv_text())
+        if message.get('type') == 'auth_required':
+            self._websocket.send_text(json.dumps({"type": "auth", "access_token": token}))
+            message = json.loads(self._websocket.recv_text())
+        if message.get('type') != 'auth_ok':
+            self.close()
+            raise AuthenticationError(message.get('message', 'Authentication failed'))
+
+    def command(self, message: dict, timeout: Optional[float] = None) -> dict:
+        """Send a command and wait for its result message, at most timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._id_lock:
+            self._last_id += 1
+            message_id = self._last_id
+        if self._error:
+            raise SendError("Connection closed") from self._error
+        try:
+            self._websocket.send_text(json.dumps(dict(message, id=message_id)))
+        except OSError as error:
+            self._fail(error)
+            raise SendError("Connection closed") from error
+        result = self._wait_for(message_id, deadline)
+        self.last_used = time.monotonic()
+        return result
+
+    def _wait_for(self, message_id: int, deadline: Optional[float]) -> dict:
+        with self._condition:
+            while True:
+                if message_id in self._results:
+                    return self._results.pop(message_id)
+                if self._error:
+                    raise WebSocketError("Connection closed") from self._error
+                if not self._reading:
+                    self._reading = True
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    # Whoever reads the result next drops it
+                    self._abandoned.add(message_id)
+                    raise TimeoutError(f'No result for command {message_id} in time')
+                self._condition.wait(remaining)
+
+        try:
+            while True:
+                self._websocket.settimeout(self._timeout if deadline is None else
+                                           max(deadline - time.monotonic(), 0.001))
+                message = json.loads(self._websocket.recv_text())
+                if message.get('type') not in ('result', 'pong'):
+                    continue
+                if message.get('id') == message_id:
+                    return message
+                with self._condition:
+                    if message.get('id') in self._abandoned:
+                        self._abandoned.discard(message.get('id'))
+                        continue
+                    self._results[message.get('id')] = message
+                    self._condition.notify_all()
+        except TimeoutError as error:
+            self._fail(error)
+            raise
+        except (OSError, ValueError, struct.error, WebSocketError) as error:
+            self._fail(error)
+            raise WebSocketError("Connection closed") from error
+        finally:
+            with self._condition:
+                self._reading = False
+                self._condition.notify_all()
+
+    def _fail(self, error: Exception) -> None:
+        with self._condition:
+            self._error = error
+            self._condition.notify_all()
+
+    def ping(self, timeout: Optional[float] = None) -> dict:
+        """Check the connection still works, Home Assistant answers with a pong."""
+        return self.command({"type": "ping"}, timeout)
+
+    def fire_event(self, event_type: str, event_data: dict,
+                   timeout: Optional[float] = None) -> dict:
+        message = {"type": "fire_event", "event_type": event_type, "event_data": event_data}
+        return self.command(message, timeout)
+
+    def close(self) -> None:
+        self._fail(WebSocketError("Connection closed by the client"))
+        self._websocket.close()
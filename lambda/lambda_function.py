@@ -1,30 +1,112 @@
 # VERSION 0.8.2
 
 """ NO NEED TO EDIT ANYTHING UNDER THE LINE """
+import os
 import sys
+import time
 import logging
-import urllib3
+import re
 import json
-import isodate
+import random
+import functools
+import contextvars
 import prompts
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from types import MappingProxyType
+from collections import OrderedDict, deque
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import Union, Optional, Mapping
+
+MODULE_LOAD_STARTED = time.perf_counter()
+
+# Optional settings, override any of these in config.py
+HTTP_POOL_MAXSIZE = 4  # Keep-alive connections kept open to Home Assistant
+HTTP_CONNECT_TIMEOUT = 10.0  # Seconds
+HTTP_READ_TIMEOUT = 10.0  # Seconds
+HTTP_RETRIES = 2  # Retries on connection errors, events are never re-sent once delivered
+HTTP_BACKOFF_FACTOR = 0.2  # Seconds, doubled on every retry
+ALEXA_RESPONSE_BUDGET = 7.0  # Seconds to answer Alexa, which gives up after 8
+RESPONSE_MARGIN = 0.5  # Seconds kept aside to build and return the response
+WARM_UP_TIMEOUT = 2.0  # Seconds warm-up invocations wait for Home Assistant to connect or answer
+RETRY_MIN_TIME = 0.5  # Seconds an attempt needs at least, no retry is made with less time left
+CIRCUIT_FAILURE_THRESHOLD = 3  # Failed Home Assistant requests in a row before failing fast
+CIRCUIT_RESET_TIMEOUT = 30.0  # Seconds of failing fast before trying Home Assistant again
+PREFETCH_NEXT_NOTIFICATION = False  # Read the next queued notification while posting an answer
+PROFILE_COLD_START = False  # Log the import cost of each dependency on the first invocation
+ASYNC_EVENTS = False  # Answer right away, events are posted and retried by a background outbox
+OUTBOX_PATH = "/tmp/alexa_actions_outbox.json"  # Survives between invocations of a warm container
+OUTBOX_MAX_SIZE = 100  # Events kept waiting for delivery, the oldest are dropped past it
+OUTBOX_MAX_ATTEMPTS = 5  # Deliveries tried per event before it is dropped
+TOKEN_CACHE_TTL = 3600.0  # Seconds a validated access token is trusted
+TOKEN_REJECTION_TTL = 60.0  # Seconds a rejected access token fails fast
+TOKEN_CACHE_SIZE = 256  # Users whose access tokens are cached
+NOTIFICATION_QUEUE_ENTITY = ""  # Entity whose "notifications" attribute queues notifications
+BATCH_ANSWERS = False  # Ask every queued notification in one session, post the answers as one event
+HA_TRANSPORT = "rest"  # "websocket" keeps a Home Assistant websocket connection open when warm
+HOME_ASSISTANT_ROUTES = {}  # Alexa user ID -> URL or settings of their own Home, see HomeRouter
+HOME_ASSISTANT_ROUTES_FILE = ""  # JSON file of more HOME_ASSISTANT_ROUTES, relative to this file
+HOME_CACHE_SIZE = 64  # Home Assistant instances whose connections are kept open between invocations
+WEBSOCKET_RETRY_AFTER = 60.0  # Seconds spent on REST after the websocket could not connect
+WEBSOCKET_PING_AFTER = 30.0  # Seconds a websocket sits idle before it is pinged ahead of an event
+WEBSOCKET_MAX_CONNECTIONS = 4  # Websockets kept open per Home, one per access token in use
+EMIT_METRICS = False  # Log per request timings in CloudWatch Embedded Metric Format
+METRICS_NAMESPACE = "AlexaActions"
+JSON_LIBRARY = "auto"  # "auto" uses orjson when it is installed, "json" never does
+DEBUG_BUFFER_SIZE = 50  # Debug records of an invocation kept in memory, logged only if it fails
+DEBUG_SAMPLE_RATE = 0.0  # Share of invocations logging all their debug records, even without DEBUG
+
 from config import *
-from typing import Union, Optional
-from urllib3 import HTTPResponse
-
-from ask_sdk_core.utils import (
-    get_account_linking_access_token,
-    is_request_type,
-    is_intent_name,
-    get_intent_name,
-    get_slot,
-    get_slot_value
-)
-from ask_sdk_core.skill_builder import SkillBuilder
-from ask_sdk_core.dispatch_components import AbstractRequestHandler
-from ask_sdk_core.dispatch_components import AbstractExceptionHandler
-from ask_sdk_core.dispatch_components import AbstractRequestInterceptor
-from ask_sdk_model import SessionEndedReason
-from ask_sdk_model.slu.entityresolution import StatusCode
+
+# Seconds spent importing each heavy dependency, logged on the first invocation
+IMPORT_TIMES = {}
+
+
+@contextmanager
+def timed_import(name: str):
+    """Record how long the imports in the block take."""
+    start = time.perf_counter()
+    yield
+    IMPORT_TIMES[name] = time.perf_counter() - start
+
+
+# isodate is only imported by the code paths that need it
+with timed_import('urllib3'):
+    import urllib3
+
+# Faster JSON library, optional
+orjson = None
+if JSON_LIBRARY == "auto":
+    try:
+        with timed_import('orjson'):
+            import orjson
+    except ImportError:
+        pass
+
+with timed_import('ask_sdk_core'):
+    from ask_sdk_core.utils import (
+        get_account_linking_access_token,
+        is_request_type,
+        is_intent_name,
+        get_intent_name,
+        get_slot,
+        get_slot_value
+    )
+    from ask_sdk_core.skill_builder import SkillBuilder
+    from ask_sdk_core.response_helper import ResponseFactory
+    from ask_sdk_core.serialize import DefaultSerializer
+    from ask_sdk_core.exceptions import SerializationException
+    from ask_sdk_core.dispatch_components import AbstractRequestHandler
+    from ask_sdk_core.dispatch_components import AbstractExceptionHandler
+    from ask_sdk_core.dispatch_components import AbstractRequestInterceptor
+    from ask_sdk_core.dispatch_components import AbstractResponseInterceptor
+    from ask_sdk_runtime.dispatch_components import GenericHandlerAdapter
+    from ask_sdk_runtime.dispatch_components import GenericRequestMapper
+
+with timed_import('ask_sdk_model'):
+    from ask_sdk_model import SessionEndedReason, RequestEnvelope, ResponseEnvelope
+    from ask_sdk_model.slu.entityresolution import StatusCode
 
 HOME_ASSISTANT_URL = HOME_ASSISTANT_URL.rstrip('/')
 
@@ -35,7 +117,82 @@ if DEBUG:
 else:
     logger.setLevel(logging.INFO)
 
+
+class DebugLog:
+    """
+        Debug records of one invocation. They are kept unformatted in a ring buffer of the
+        last DEBUG_BUFFER_SIZE records, and only formatted and logged by flush, when the
+        invocation fails. A sampled invocation logs them as they come instead.
+    """
+
+    def __init__(self, size: int = DEBUG_BUFFER_SIZE, sampled: bool = False):
+        self.sampled = sampled
+        self.records = deque(maxlen=size)
+
+    def add(self, msg: str, args: tuple) -> None:
+        if self.sampled:
+            _log_debug_record(msg, args)
+        else:
+            self.records.append((msg, args))
+
+    def flush(self, reason: str) -> None:
+        """Log the buffered records, oldest first, and empty the buffer."""
+        if not self.records:
+            return
+        logger.error(f'{reason}, the last {len(self.records)} debug records follow')
+        while self.records:
+            _log_debug_record(*self.records.popleft())
+
+
+def _log_debug_record(msg: str, args: tuple) -> None:
+    # Bypasses the level of the logger, which is above DEBUG unless DEBUG is set
+    logger.handle(logger.makeRecord(logger.name, logging.DEBUG, __file__, 0, msg, args, None))
+
+
+# DebugLog of the current invocation. Context variables follow the request into the I/O
+# executor through HomeAssistant._submit.
+DEBUG_LOG = contextvars.ContextVar('debug_log', default=None)
+
+
+def start_debug_log() -> None:
+    """Give the current invocation its DebugLog, sampled at DEBUG_SAMPLE_RATE."""
+    sampled = DEBUG_SAMPLE_RATE > 0 and random.random() < DEBUG_SAMPLE_RATE
+    buffered = sampled or DEBUG_BUFFER_SIZE > 0
+    DEBUG_LOG.set(DebugLog(DEBUG_BUFFER_SIZE, sampled) if buffered else None)
+
+
+def debug(msg: str, *args) -> None:
+    """
+        Log a debug record, %-formatted with args only if it is ever written: right away
+        with DEBUG, otherwise when the DebugLog of the invocation logs it.
+    """
+
+    if DEBUG:
+        logger.debug(msg, *args)
+        return
+    debug_log = DEBUG_LOG.get()
+    if debug_log is not None:
+        debug_log.add(msg, args)
+
+
+def flush_debug_log(reason: str) -> None:
+    """Log the debug records buffered by the current invocation, see DebugLog."""
+    debug_log = DEBUG_LOG.get()
+    if debug_log is not None:
+        debug_log.flush(reason)
+
+
 INPUT_TEXT_ENTITY = "input_text.alexa_actionable_notification"
+EVENT_TYPE = "alexa_actionable_notification"
+BATCH_EVENT_TYPE = "alexa_actionable_notification_batch"
+DEFAULT_LANGUAGE = "en"
+
+# Session attribute holding the notification fetched at launch
+SESSION_HA_STATE = "haState"
+# Session attribute holding the notifications left to ask and the answers collected in batch mode
+SESSION_BATCH = "haBatch"
+# Request attribute holding the RequestMetrics of the current request
+METRICS_REQUEST_ATTRIBUTE = "metrics"
 
 RESPONSE_YES = "ResponseYes"
 RESPONSE_NO = "ResponseNo"
@@ -45,61 +202,1189 @@ RESPONSE_NUMERIC = "ResponseNumeric"
 RESPONSE_DURATION = "ResponseDuration"
 RESPONSE_STRING = "ResponseString"
 
+# JSON codec of Home Assistant payloads and Alexa envelopes: json_loads takes the bytes as
+# they come off the socket, json_dumps returns the bytes to send
+if orjson is not None:
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+else:
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+
+# Runs blocking Home Assistant requests for the async client methods, one worker per
+# pooled connection so overlapping requests never wait on each other for a socket.
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=HTTP_POOL_MAXSIZE, thread_name_prefix='home-assistant')
+
+
+class TransportResponse:
+    """Outcome of a Home Assistant request, whichever transport carried it."""
+
+    def __init__(self, status: int, data: bytes = b'', body=None):
+        self.status = status
+        self.data = data
+        self._body = body
+
+    def json(self):
+        """The decoded response body."""
+        if self._body is None:
+            self._body = json_loads(self.data)
+        return self._body
+
+
+class RestTransport:
+    """
+        Home Assistant REST API, over the pooled HTTP connections of a Home. Requests given a
+        timeout are tried once, the caller retries them within its own deadline. The others
+        are retried by the pool, up to HTTP_RETRIES times.
+    """
+
+    def __init__(self, home: 'Home'):
+        self.home = home
+
+    def get_state(self, entity_id: str, token: str,
+                  timeout: Optional[urllib3.Timeout] = None) -> TransportResponse:
+        response = self.home.http.request(
+            'GET',
+            f'{self.home.url}/api/states/{entity_id}',
+            headers={
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json'
+            },
+            timeout=timeout,
+            retries=False if timeout is not None else None
+        )
+        self.home.log_connection_stats()
+        return TransportResponse(response.status, response.data)
+
+    def fire_event(self, event_type: str, event_data: dict, token: str,
+                   timeout: Optional[urllib3.Timeout] = None) -> TransportResponse:
+        response = self.home.http.request(
+            'POST',
+            f'{self.home.url}/api/events/{event_type}',
+            headers={
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json'
+            },
+            body=json_dumps(event_data),
+            timeout=timeout,
+            retries=False if timeout is not None else None
+        )
+        self.home.log_connection_stats()
+        return TransportResponse(response.status, response.data)
+
+    def warm_up(self, token: str, timeout: urllib3.Timeout) -> int:
+        """
+            Open a pooled connection to Home Assistant, resolving its name and doing the TLS
+            handshake. Returns the HTTP status Home Assistant answered with.
+        """
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.home.http.request('GET', f'{self.home.url}/api/', headers=headers,
+                                          timeout=timeout, retries=False)
+        return response.status
 
-class Borg:
-    """Borg MonoState Class for State Persistence."""
-    _shared_state = {}
+    def close(self) -> None:
+        self.home.http.clear()
+
+
+class WebsocketTransport:
+    """
+        Home Assistant websocket API of a Home, with one authenticated connection per token
+        kept open across warm invocations to fire events. Account linking tokens rotate, so
+        only the WEBSOCKET_MAX_CONNECTIONS most recently used connections are kept, the
+        others are closed. A connection idle for more than
+        WEBSOCKET_PING_AFTER seconds is pinged first, and replaced if it dropped meanwhile.
+        Events go over REST when the websocket can't be opened, but never once they were
+        sent over it: a connection dropping then answers 503, like a timeout.
+
+        Entities are still read over REST: the websocket API only reads them all at once,
+        and a real install has hundreds of them.
+    """
+
+    # Websocket API error codes, as the HTTP status the REST API would answer
+    ERROR_STATUS = {"unauthorized": 401, "not_found": 404, "invalid_format": 400}
+
+    def __init__(self, home: 'Home', fallback: RestTransport):
+        self.home = home
+        self.fallback = fallback
+        self._connections = OrderedDict()  # token -> HomeAssistantWebSocket, least recent first
+        self._lock = Lock()
+        self._retry_at = 0.0
+
+    def _connection(self, token: str, timeout: Optional[float] = None):
+        from ha_websocket import HomeAssistantWebSocket
+
+        stale = []
+        with self._lock:
+            connection = self._connections.get(token)
+            if connection is None or connection.closed:
+                if connection is not None:
+                    stale.append(connection)
+                debug("Opening Home Assistant websocket")
+                connection = self._connections[token] = HomeAssistantWebSocket(
+                    self.home.url, token, verify_ssl=self.home.verify_ssl,
+                    timeout=self.home.read_timeout if timeout is None else timeout)
+            self._connections.move_to_end(token)
+            while len(self._connections) > WEBSOCKET_MAX_CONNECTIONS:
+                stale.append(self._connections.popitem(last=False)[1])
+        for evicted in stale:
+            evicted.close()
+        return connection
+
+    def _command(self, token: str, method: str, *args, timeout: Optional[urllib3.Timeout] = None):
+        """
+            Run a websocket command, returns None when REST has to be used instead, which
+            is only the case when the command was never sent.
+
+            :raises TimeoutError: The command was sent, but its result did not come within the
+                total of the timeout. It is not tried again, Home Assistant may still run it.
+            :raises ConnectionError: The command was sent, but the connection dropped before
+                its result came. It is not tried again either.
+        """
+
+        from ha_websocket import AuthenticationError, SendError, WebSocketError
+
+        if time.monotonic() < self._retry_at:
+            return None
+        seconds = timeout.total if timeout is not None else None
+        deadline = time.monotonic() + (self.home.read_timeout if seconds is None else seconds)
+        for attempt in range(2):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                connection = self._connection(token)
+            except AuthenticationError as error:
+                return {"success": False, "error": {"code": "unauthorized", "message": str(error)}}
+            except (OSError, ValueError, WebSocketError) as error:
+                logger.warning(f'Could not open the Home Assistant websocket: {error}')
+                continue
+
+            if time.monotonic() - connection.last_used > WEBSOCKET_PING_AFTER:
+                # A connection idle since the last invocation may have been dropped, only a ping
+                # can be sent again on a new one if it was
+                try:
+                    connection.ping(timeout=remaining)
+                except (TimeoutError, WebSocketError) as error:
+                    logger.warning(f'Home Assistant websocket failed: {error}')
+                    self._drop(token, connection)
+                    continue
+                remaining = deadline - time.monotonic()
+
+            try:
+                return getattr(connection, method)(*args, timeout=remaining)
+            except SendError as error:
+                logger.warning(f'Home Assistant websocket failed: {error}')
+                self._drop(token, connection)
+            except TimeoutError:
+                self._drop(token, connection)
+                raise
+            except WebSocketError as error:
+                self._drop(token, connection)
+                raise ConnectionError('Home Assistant websocket closed after the command was '
+                                      f'sent: {error}') from error
+        self._retry_at = time.monotonic() + WEBSOCKET_RETRY_AFTER
+        return None
+
+    def _drop(self, token: str, connection) -> None:
+        """Forget a failed connection, unless another thread already replaced it."""
+        with self._lock:
+            if self._connections.get(token) is connection:
+                del self._connections[token]
+        connection.close()
+
+    def _error_response(self, result: dict) -> TransportResponse:
+        error = result.get('error') or {}
+        return TransportResponse(self.ERROR_STATUS.get(error.get('code'), 500), json_dumps(error))
+
+    def get_state(self, entity_id: str, token: str,
+                  timeout: Optional[urllib3.Timeout] = None) -> TransportResponse:
+        return self.fallback.get_state(entity_id, token, timeout)
+
+    def fire_event(self, event_type: str, event_data: dict, token: str,
+                   timeout: Optional[urllib3.Timeout] = None) -> TransportResponse:
+        result = self._command(token, 'fire_event', event_type, event_data, timeout=timeout)
+        if result is None:
+            return self.fallback.fire_event(event_type, event_data, token, timeout)
+        if not result.get('success'):
+            return self._error_response(result)
+        return TransportResponse(200, body=result.get('result'))
+
+    def warm_up(self, token: str, timeout: urllib3.Timeout) -> int:
+        """Open the REST connection reads go over, and the websocket of the token."""
+        from ha_websocket import WebSocketError
+
+        status = self.fallback.warm_up(token, timeout)
+        if token and time.monotonic() >= self._retry_at:
+            try:
+                self._connection(token, timeout.total)
+            except (OSError, ValueError, WebSocketError) as error:
+                logger.warning(f'Home Assistant websocket failed: {error}')
+        return status
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for connection in connections.values():
+            connection.close()
+        self.fallback.close()
+
+
+class CircuitBreaker:
+    """
+        Stops calling Home Assistant while it is unreachable.
+
+        Closed: requests go through, and CIRCUIT_FAILURE_THRESHOLD failures in a row open
+        the circuit. Open: requests fail right away for CIRCUIT_RESET_TIMEOUT seconds.
+        Half open: one trial request goes through, closing the circuit if it succeeds
+        and opening it again if it fails. Another trial goes through if the first has no
+        outcome after CIRCUIT_RESET_TIMEOUT seconds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+        """Check if a request may be sent now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            if self.state == self.OPEN:
+                logger.info("Home Assistant circuit half open, sending a trial request")
+            else:
+                logger.warning("Home Assistant trial request got no outcome, sending another")
+            self.state = self.HALF_OPEN
+            # Since the trial started
+            self._opened_at = time.monotonic()
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Home Assistant is reachable again, circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f'Home Assistant unreachable after {self.failures} failures, '
+                                   'circuit open')
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Home:
+    """
+        One Home Assistant instance and what is kept of it across warm invocations: its
+        pool of keep-alive connections, the transport reaching it, the circuit breaker
+        tracking its health, and its NotificationCache.
+    """
+
+    def __init__(self, url: str, token: str, verify_ssl: bool, connect_timeout: float,
+                 read_timeout: float):
+        self.url = url
+        self.token = token
+        self.verify_ssl = verify_ssl
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http = urllib3.PoolManager(
+            num_pools=1,
+            maxsize=HTTP_POOL_MAXSIZE,
+            cert_reqs='CERT_REQUIRED' if verify_ssl else 'CERT_NONE',
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+            retries=urllib3.Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                raise_on_status=False
+            )
+        )
+        self.breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+        self.notification_cache = NotificationCache()
+        rest = RestTransport(self)
+        self.transport = WebsocketTransport(self, rest) if HA_TRANSPORT == "websocket" else rest
+
+    def log_connection_stats(self) -> None:
+        """Log how many requests to this Home Assistant reused a pooled connection."""
+        pool = self.http.connection_from_url(self.url)
+        debug('Home Assistant connections: %d new, %d reused',
+              pool.num_connections, pool.num_requests - pool.num_connections)
+
+    def close(self) -> None:
+        """Close the connections to this Home Assistant."""
+        self.transport.close()
+
+
+class UnroutedUserError(LookupError):
+    """An Alexa user has no route, and there is no default Home Assistant."""
+
+
+class HomeRouter:
+    """
+        Routes each Alexa user to their Home Assistant, so one deployment can serve many
+        homes. HOME_ASSISTANT_ROUTES and HOME_ASSISTANT_ROUTES_FILE map user IDs to the URL
+        of their Home Assistant, or to a dict of its settings:
+
+            url: Base URL of the Home Assistant.
+            token: Long lived access token, the account linking token is used without one.
+            verify_ssl, connect_timeout, read_timeout: VERIFY_SSL, HTTP_CONNECT_TIMEOUT and
+                HTTP_READ_TIMEOUT by default.
+
+        Other users go to HOME_ASSISTANT_URL with TOKEN, which answers every unknown Alexa
+        account with the notifications of that household. With HOME_ASSISTANT_URL left empty
+        they are rejected instead, see UnroutedUserError. Users with the same settings share
+        one Home. The HOME_CACHE_SIZE most recently used Homes are kept, the connections of
+        the others are closed.
+    """
+
+    SETTINGS = ('url', 'token', 'verify_ssl', 'connect_timeout', 'read_timeout')
+
+    def __init__(self, routes: dict, max_size: int):
+        self.max_size = max_size
+        self.default = (HOME_ASSISTANT_URL, TOKEN, VERIFY_SSL,
+                        HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT) if HOME_ASSISTANT_URL else None
+        self.routes = {user_id: self._settings(user_id, route) for user_id, route in routes.items()}
+        self._homes = OrderedDict()  # settings -> Home
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._homes)
+
+    def _settings(self, user_id: str, route: Union[str, dict]) -> tuple:
+        """The settings of a route, as a tuple keying its Home."""
+        if isinstance(route, str):
+            route = {"url": route}
+        if not isinstance(route, dict) or not isinstance(route.get('url'), str) \
+                or set(route) - set(self.SETTINGS):
+            raise ValueError(f'Invalid Home Assistant route for {user_id}, it needs a "url" '
+                             f'and only takes {", ".join(self.SETTINGS)}')
+        return (route['url'].rstrip('/'), route.get('token', ""),
+                route.get('verify_ssl', VERIFY_SSL),
+                route.get('connect_timeout', HTTP_CONNECT_TIMEOUT),
+                route.get('read_timeout', HTTP_READ_TIMEOUT))
+
+    def home_for(self, user_id: Optional[str]) -> Home:
+        """
+            The Home of an Alexa user, opened if it isn't already.
+
+            :raises UnroutedUserError: The user has no route and HOME_ASSISTANT_URL is empty.
+        """
+        settings = self.routes.get(user_id, self.default)
+        if settings is None:
+            raise UnroutedUserError(f'No Home Assistant route for user {user_id}')
+        evicted = None
+        with self._lock:
+            home = self._homes.get(settings)
+            if home is not None:
+                self._homes.move_to_end(settings)
+                return home
+            home = self._homes[settings] = Home(*settings)
+            if len(self._homes) > self.max_size:
+                evicted = self._homes.popitem(last=False)[1]
+
+        if evicted is not None:
+            debug('Closing the connections to %s, least recently used', evicted.url)
+            evicted.close()
+        return home
+
+
+def load_routes() -> dict:
+    """HOME_ASSISTANT_ROUTES, with the routes of HOME_ASSISTANT_ROUTES_FILE on top."""
+    routes = dict(HOME_ASSISTANT_ROUTES)
+    if HOME_ASSISTANT_ROUTES_FILE:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), HOME_ASSISTANT_ROUTES_FILE)
+        with open(path, encoding='utf-8') as routes_file:
+            routes.update(json.load(routes_file))
+    return routes
+
+
+# Read once per container, Homes are opened on the first request of one of their users
+HOMES = HomeRouter(load_routes(), HOME_CACHE_SIZE)
+
+
+def remaining_time(handler_input, started: float) -> float:
+    """
+        Seconds Home Assistant requests may still take: what is left of the time to answer
+        Alexa, and of the Lambda invocation when running on Lambda, minus RESPONSE_MARGIN.
+    """
+
+    remaining = ALEXA_RESPONSE_BUDGET - (time.perf_counter() - started)
+    get_remaining_time = getattr(handler_input.context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time is not None:
+        remaining = min(remaining, get_remaining_time() / 1000)
+    return remaining - RESPONSE_MARGIN
+
+
+def request_timeout(handler_input, started: float, home: Home) -> urllib3.Timeout:
+    """HTTP timeout of one attempt, fitting in the remaining_time."""
+    total = max(remaining_time(handler_input, started), 0.1)
+    return urllib3.Timeout(total=total, connect=min(home.connect_timeout, total),
+                           read=min(home.read_timeout, total))
+
+
+class TokenManager:
+    """
+        Access tokens per Alexa user, with what Home Assistant last said about them.
+
+        Validated tokens are trusted for TOKEN_CACHE_TTL seconds, and the least recently
+        used user is evicted past TOKEN_CACHE_SIZE users. Requests with a rejected token fail
+        right away instead of getting another 401 from Home Assistant, for the shorter
+        TOKEN_REJECTION_TTL: a 401 can come from a token that was just created, or from
+        a Home Assistant that is still starting.
+    """
+
+    def __init__(self, ttl: float, max_size: int, rejection_ttl: float):
+        self.ttl = ttl
+        self.rejection_ttl = rejection_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+        self._tokens = OrderedDict()  # user ID -> (token, valid, checked at)
+        self._lock = Lock()
+
+    def _entry(self, user_id: Optional[str], token: Optional[str]) -> Optional[tuple]:
+        entry = self._tokens.get(user_id)
+        if entry is None or entry[0] != token:
+            return None
+        if time.monotonic() - entry[2] > (self.ttl if entry[1] else self.rejection_ttl):
+            return None
+        self._tokens.move_to_end(user_id)
+        return entry
+
+    def resolve(self, user_id: Optional[str], token: Optional[str]) -> Optional[str]:
+        """Register the token a request carries, counting whether it was validated before."""
+        with self._lock:
+            entry = self._entry(user_id, token)
+            if entry is not None and entry[1]:
+                self.hits += 1
+            else:
+                self.misses += 1
+        debug('Token cache: %d hits, %d misses, %d rejections',
+              self.hits, self.misses, self.rejections)
+        return token
+
+    def is_rejected(self, user_id: Optional[str], token: Optional[str]) -> bool:
+        """Check if Home Assistant is known to reject the token."""
+        if not token:
+            return True
+        with self._lock:
+            entry = self._entry(user_id, token)
+            return entry is not None and not entry[1]
+
+    def record(self, user_id: Optional[str], token: Optional[str], status: int) -> None:
+        """Remember whether Home Assistant accepted the token."""
+        if status == 401:
+            valid = False
+            self.rejections += 1
+        elif status < 400:
+            valid = True
+        else:
+            return
+
+        with self._lock:
+            self._tokens[user_id] = (token, valid, time.monotonic())
+            self._tokens.move_to_end(user_id)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+
+
+TOKENS = TokenManager(TOKEN_CACHE_TTL, TOKEN_CACHE_SIZE, TOKEN_REJECTION_TTL)
+
+
+class EventOutbox:
+    """
+        Events waiting to be posted to Home Assistant by a background thread, so the
+        answer can be spoken without waiting for Home Assistant.
+
+        Events are keyed by event_id, or by the answered event_ids of a batch, a newer answer
+        to the same notification replaces the queued one. The outbox is written to OUTBOX_PATH
+        on every change: a warm container picks up what the previous invocation could not
+        deliver. Deliveries failing on a connection error or a 5xx are retried with backoff,
+        up to OUTBOX_MAX_ATTEMPTS times.
+
+        The file is only readable by its owner, as it holds the account linking tokens of the
+        events to deliver. Events of a Home with a configured token are saved without one.
+    """
+
+    def __init__(self, path: str, max_size: int, max_attempts: int):
+        self.path = path
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        # key -> {"key", "event_type", "data", "token", "user_id", "attempts"}
+        self._events = OrderedDict()
+        self._lock = Lock()
+        self._wake = Event()
+        self._worker: Optional[Thread] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def for_worker(self, index: int) -> 'EventOutbox':
+        """
+            The outbox of a forked server worker, in a file of its own: workers sharing one
+            would deliver the same events and overwrite each other's. The worker index keeps
+            the file of a restarted worker, rather than its pid.
+        """
+        return EventOutbox(f'{self.path}.{index}', self.max_size, self.max_attempts)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding='utf-8') as outbox:
+                for entry in json.load(outbox):
+                    entry.setdefault('key', entry['data'].get('event_id'))
+                    entry.setdefault('event_type', EVENT_TYPE)
+                    self._events[entry['key']] = entry
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, AttributeError, TypeError) as error:
+            logger.error(f'Ignoring unreadable event outbox {self.path}: {error}')
+        debug('Loaded %d undelivered events', len(self._events))
+
+    def _save(self) -> None:
+        temporary_path = self.path + '.tmp'
+        try:
+            # The mode only applies to new files, never reuse one left by a crash
+            os.unlink(temporary_path)
+        except FileNotFoundError:
+            pass
+        descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with open(descriptor, 'w', encoding='utf-8') as outbox:
+            json.dump(list(self._events.values()), outbox)
+        os.replace(temporary_path, self.path)
+
+    def put(self, event_data: dict, token: Optional[str], user_id: Optional[str],
+            event_type: str = EVENT_TYPE, key: Optional[str] = None) -> None:
+        """
+            Queue an event and wake the worker. A None token posts it with the token
+            configured for the Home of the user.
+        """
+        key = event_data.get('event_id') if key is None else key
+        with self._lock:
+            self._events.pop(key, None)
+            self._events[key] = {
+                "key": key, "event_type": event_type, "data": event_data,
+                "token": token, "user_id": user_id, "attempts": 0
+            }
+            while len(self._events) > self.max_size:
+                _, dropped = self._events.popitem(last=False)
+                logger.error(f'Event outbox full, dropping event {dropped["key"]}')
+            self._save()
+        self.kick()
+
+    def kick(self) -> None:
+        """Start delivering queued events, if there are any."""
+        with self._lock:
+            if not self._events:
+                return
+            # Under the lock, so concurrent puts start a single worker
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = Thread(target=self._run, name='event-outbox', daemon=True)
+                self._worker.start()
+            self._wake.set()
+
+    def _run(self) -> None:
+        backoff = HTTP_BACKOFF_FACTOR or 0.1
+        while True:
+            self._wake.clear()
+            if self._deliver_all():
+                backoff = HTTP_BACKOFF_FACTOR or 0.1
+            else:
+                self._wake.wait(backoff)
+                backoff = min(backoff * 2, CIRCUIT_RESET_TIMEOUT)
+            with self._lock:
+                # An event put since the last delivery keeps this worker going
+                if not self._events:
+                    self._worker = None
+                    return
+
+    def _deliver_all(self) -> bool:
+        """Try every queued event once, returns False if any is left for a retry."""
+        with self._lock:
+            entries = list(self._events.items())
+
+        for event_id, entry in entries:
+            try:
+                home = HOMES.home_for(entry['user_id'])
+            except UnroutedUserError as error:
+                # Queued before the routes changed, there is nowhere to deliver it now
+                logger.error(f'Dropping event {event_id}: {error}')
+                with self._lock:
+                    if self._events.get(event_id) is entry:
+                        del self._events[event_id]
+                        self._save()
+                continue
+            if not home.breaker.allow():
+                continue
+            delivered = self._deliver(home, entry)
+            with self._lock:
+                if self._events.get(event_id) is not entry:
+                    continue  # Replaced by a newer answer meanwhile
+                if delivered or entry['attempts'] >= self.max_attempts:
+                    if not delivered:
+                        logger.error(f'Giving up on event {event_id} '
+                                     f'after {entry["attempts"]} attempts')
+                    del self._events[event_id]
+                self._save()
+        return not self._events
+
+    def _deliver(self, home: 'Home', entry: dict) -> bool:
+        """
+            Post one event to the Home it was answered from, returns False if it should be
+            tried again.
+        """
+        entry['attempts'] += 1
+        token = entry['token'] or home.token
+        try:
+            response = home.transport.fire_event(entry['event_type'], entry['data'], token)
+        except Exception as error:
+            # Anything but a response is a failed attempt, the worker carries on with the others
+            logger.warning(f'Could not deliver event {entry["key"]}: {error!r}')
+            home.breaker.record_failure()
+            return False
+
+        TOKENS.record(entry['user_id'], token, response.status)
+        if response.status >= 500:
+            home.breaker.record_failure()
+            return False
+        home.breaker.record_success()
+        if response.status >= 400:
+            # Retrying won't fix a rejected token or a missing entity
+            logger.error(f'{response.status} Error from Home Assistant delivering event '
+                         f'{entry["key"]}, dropping it')
+        return True
+
+
+OUTBOX = EventOutbox(OUTBOX_PATH, OUTBOX_MAX_SIZE, OUTBOX_MAX_ATTEMPTS) if ASYNC_EVENTS else None
+
+
+class RequestMetrics:
+    """Wall time spent in each phase of one request, in milliseconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.handler = None
+        self.http_status = None
+
+    @contextmanager
+    def measure(self, phase: str):
+        """Add the time spent in the block to the phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.timings[phase] = self.timings.get(phase, 0.0) + elapsed
+
+    def to_emf(self, locale: Optional[str]) -> dict:
+        """Build a CloudWatch Embedded Metric Format record from the timings."""
+        timings = dict(self.timings)
+        timings['Total'] = (time.perf_counter() - self.started) * 1000
+        if 'Handler' in timings:
+            # What the handler spent outside Home Assistant calls went into building the response
+            io_time = sum(timings.get(phase, 0.0)
+                          for phase in ('Token', 'HomeAssistantGet', 'HomeAssistantPost'))
+            timings['ResponseBuilding'] = max(timings.pop('Handler') - io_time, 0.0)
+
+        metrics = [{"Name": phase, "Unit": "Milliseconds"} for phase in timings]
+        memory = max_memory_used()
+        if memory is not None:
+            metrics.append({"Name": "MaxMemoryUsed", "Unit": "Megabytes"})
+
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Handler"], ["Handler", "Locale"]],
+                    "Metrics": metrics
+                }]
+            },
+            "Handler": self.handler or "None",
+            "Locale": locale or "None",
+            "HttpStatus": self.http_status
+        }
+        record.update({phase: round(value, 3) for phase, value in timings.items()})
+        if memory is not None:
+            record["MaxMemoryUsed"] = memory
+        return record
+
+
+def max_memory_used() -> Optional[float]:
+    """Peak resident memory of the process so far in megabytes, None where it is not known."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Kilobytes on Linux, where Lambda runs
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def request_metrics(handler_input) -> RequestMetrics:
+    """Get the RequestMetrics of this request, creating them if needed."""
+    request_attributes = handler_input.attributes_manager.request_attributes
+    metrics = request_attributes.get(METRICS_REQUEST_ATTRIBUTE)
+    if metrics is None:
+        metrics = request_attributes[METRICS_REQUEST_ATTRIBUTE] = RequestMetrics()
+    return metrics
+
+
+def emit_metrics(handler_input) -> None:
+    """Write the metrics of this request to the logs, where CloudWatch picks them up."""
+    if not EMIT_METRICS:
+        return
+    locale = getattr(handler_input.request_envelope.request, 'locale', None)
+    sys.stdout.write(json.dumps(request_metrics(handler_input).to_emf(locale)) + '\n')
+
+
+class NotificationError(ValueError):
+    """Home Assistant sent a notification the skill can't ask."""
+
+
+def check_notification(notification) -> Optional[float]:
+    """
+        Check that a notification sent by Home Assistant can be asked, and return the
+        Unix timestamp it expires at, if any.
+
+        :raises NotificationError: The notification is not an object, it has no text, one
+            of its fields is not a string, or it expires at a time that can't be read.
+    """
+
+    if not isinstance(notification, dict):
+        raise NotificationError(f'Notification is a {type(notification).__name__}, not an object')
+    if not isinstance(notification.get('text'), str):
+        raise NotificationError('Notification has no text')
+    for key in ('event', 'confirmation_text', 'response_text'):
+        value = notification.get(key)
+        if value is not None and not isinstance(value, str):
+            raise NotificationError(f'Notification {key} is not a string')
+    expires = notification.get('expires')
+    if expires is None:
+        return None
+    try:
+        return _timestamp(expires)
+    except (TypeError, ValueError, OverflowError):
+        raise NotificationError(
+            f'Notification expires at {expires!r}, not a timestamp or an ISO 8601 date')
+
+
+class Notification:
+    """
+        A notification waiting for an answer, as Home Assistant sent it. Records are
+        immutable, so a decoded one is shared by every request asking it. Moving on to
+        another notification replaces the record.
+    """
+
+    __slots__ = ('event_id', 'text', 'confirmation_text', 'response_text')
+
+    error = False
+
+    def __init__(self, event_id: Optional[str], text: str,
+                 confirmation_text: Optional[str] = None, response_text: Optional[str] = None):
+        set_attribute = object.__setattr__
+        set_attribute(self, 'event_id', event_id)
+        set_attribute(self, 'text', text)
+        set_attribute(self, 'confirmation_text', confirmation_text)
+        set_attribute(self, 'response_text', response_text)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.to_session() == other.to_session()
+
+    def __hash__(self):
+        return hash((self.event_id, self.text, self.confirmation_text, self.response_text))
+
+    def __repr__(self):
+        return (f'Notification(event_id={self.event_id!r}, text={self.text!r}, '
+                f'confirmation_text={self.confirmation_text!r}, '
+                f'response_text={self.response_text!r})')
+
+    @classmethod
+    def from_home_assistant(cls, notification: dict) -> 'Notification':
+        """
+            Build the record of a notification sent by Home Assistant.
+
+            :raises NotificationError: See check_notification.
+        """
+
+        check_notification(notification)
+        return cls(notification.get('event'), notification['text'],
+                   notification.get('confirmation_text'), notification.get('response_text'))
+
+    @classmethod
+    def from_session(cls, state: dict) -> 'Notification':
+        """Rebuild the record kept in the session attributes by to_session."""
+        return cls(state['event_id'], state['text'],
+                   state.get('confirmation_text'), state.get('response_text'))
+
+    def to_session(self) -> dict:
+        """The record as kept in the session attributes."""
+        return {
+            "event_id": self.event_id,
+            "text": self.text,
+            "confirmation_text": self.confirmation_text,
+            "response_text": self.response_text
+        }
+
+
+class ErrorResult:
+    """
+        Home Assistant could not give a notification, text is the error to speak. It has
+        the fields of a Notification, so handlers read either without checking which one
+        they got, but never an event to answer.
+    """
+
+    __slots__ = ('text',)
+
+    error = True
+    event_id = None
+    confirmation_text = None
+    response_text = None
+
+    def __init__(self, text: str):
+        object.__setattr__(self, 'text', text)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __repr__(self):
+        return f'ErrorResult(text={self.text!r})'
+
+
+def _timestamp(value: Union[int, float, str]) -> float:
+    """Unix timestamp of an expires value, templates often render numbers as strings."""
+    if isinstance(value, str):
+        # An ISO 8601 date never reads as a number, skip the float() that would raise
+        if value[4:5] == '-':
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        return float(value)
+    if isinstance(value, bool):
+        raise TypeError('A boolean is not a timestamp')
+    return float(value)
+
+
+class NotificationQueue:
+    """
+        Notifications waiting for an answer, read in a single request from the
+        "notifications" attribute of NOTIFICATION_QUEUE_ENTITY. Each one is a dict
+        with the keys of the single input_text notification, plus optionally:
+
+            device_id: Alexa device ID the notification is meant for, any device otherwise.
+            expires: Unix timestamp or ISO 8601 date after which it is no longer asked.
+
+        Notifications are indexed by event_id and by device, oldest first. They come
+        checked by queued_notifications, paired with the timestamp they expire at. Those
+        without an event can't be answered and only the oldest of an event is kept, so
+        both indices hold the same notifications.
+    """
+
+    def __init__(self, notifications: list, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        self.by_event_id = {}
+        self.by_device = {}
+        for notification, expires_at in notifications:
+            if expires_at is not None and expires_at <= now:
+                continue
+            event_id = notification.get('event')
+            if event_id is None:
+                logger.error('Skipping queued notification without an event')
+                continue
+            if event_id in self.by_event_id:
+                logger.error(f'Skipping queued notification with duplicate event {event_id}')
+                continue
+            self.by_event_id[event_id] = notification
+            self.by_device.setdefault(notification.get('device_id'), []).append(notification)
+
+    def __len__(self) -> int:
+        return len(self.by_event_id)
+
+    def pending_for(self, device_id: Optional[str]) -> list:
+        """Notifications a device should ask, oldest first."""
+        targeted = self.by_device.get(device_id, []) if device_id else []
+        untargeted = self.by_device.get(None, [])
+        if not targeted or not untargeted:
+            return targeted or untargeted
+        return [notification for notification in self.by_event_id.values()
+                if notification.get('device_id') in (device_id, None)]
+
+    def next_for(self, device_id: Optional[str],
+                 skip_event_id: Optional[str] = None) -> Optional[dict]:
+        """The oldest notification a device should ask, other than skip_event_id."""
+        for notification in self.pending_for(device_id):
+            if notification.get('event') != skip_event_id:
+                return notification
+        return None
+
+
+# Durations as Alexa sends them for AMAZON.DURATION, like PT10M, PT1H30M or P2D. Years and
+# months last as long as the dates they start from, those are left to isodate.
+DURATION_PATTERN = re.compile(r'P(?:(\d+)W)?(?:(\d+)D)?'
+                              r'(?:T(?=\d)(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?')
+
+
+def duration_seconds(duration: str) -> float:
+    """Length of an ISO 8601 duration in seconds."""
+    match = DURATION_PATTERN.fullmatch(duration)
+    if match and duration != 'P':
+        weeks, days, hours, minutes, seconds = match.groups()
+        return (int(weeks or 0) * 604800 + int(days or 0) * 86400 + int(hours or 0) * 3600 +
+                int(minutes or 0) * 60 + float(seconds or 0))
+
+    import isodate
+    return isodate.parse_duration(duration).total_seconds()
+
+
+def decode_notification(entity: dict) -> Optional[Notification]:
+    """The notification held by the state of the input_text entity, None without one."""
+    state = entity.get('state')
+    return Notification.from_home_assistant(json_loads(state)) if state else None
+
+
+def queued_notifications(entity: dict) -> list:
+    """
+        The valid notifications held by the NOTIFICATION_QUEUE_ENTITY, each paired with the
+        timestamp it expires at, see NotificationQueue. Expiry dates are read here, once per
+        decoded entity, rather than on every request building a queue.
+    """
+    notifications = []
+    for notification in (entity.get('attributes') or {}).get('notifications') or []:
+        try:
+            expires_at = check_notification(notification)
+        except NotificationError as error:
+            logger.error(f'Skipping queued notification: {error}')
+            continue
+        notifications.append((notification, expires_at))
+    return notifications
+
+
+class NotificationCache:
+    """
+        Decoded notification entities of a Home, kept across warm invocations.
+
+        A response byte for byte the same as the cached one is not decoded at all, otherwise
+        its last_changed, last_updated and context id tell whether the entity changed since
+        it was decoded. Home Assistant gives every state write a new context, so an unchanged
+        one means the notification is the same. Posting an answer invalidates the cache, as
+        Home Assistant is about to move on to another notification.
+    """
 
     def __init__(self):
-        self.__dict__ = self._shared_state
+        self._entries = {}  # entity_id -> (data, version, value)
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, entity_id: str, response: TransportResponse, parse):
+        """
+            The value parse returns for the entity of the response, from the cache when it
+            didn't change. Values parse returns None for are never cached.
+        """
+
+        entry = self._entries.get(entity_id)
+        if entry is not None and response.data and response.data == entry[0]:
+            self.hits += 1
+            return entry[2]
+
+        entity = response.json()
+        version = (entity.get('last_changed'), entity.get('last_updated'),
+                   (entity.get('context') or {}).get('id'))
+        if entry is not None and version[2] and version == entry[1]:
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        value = parse(entity)
+        if value is not None:
+            self._entries[entity_id] = (response.data, version, value)
+        return value
 
+    def invalidate(self) -> None:
+        self._entries = {}
 
-class HomeAssistant(Borg):
-    """HomeAssistant Wrapper Class."""
 
-    def __init__(self, handler_input=None):
-        Borg.__init__(self)
-        if handler_input:
-            self.handler_input = handler_input
+# Request attribute holding the HomeAssistant object of the current request
+HA_REQUEST_ATTRIBUTE = "homeAssistant"
+
+
+class HomeAssistant:
+    """
+        HomeAssistant Wrapper Class.
+
+        An instance lives exactly as long as the request it was created for: it is kept in
+        the request attributes, which the SDK builds fresh for every invocation. Nothing is
+        shared between requests, so concurrent requests in one process can't see each
+        other's state or token.
+    """
+
+    def __init__(self, handler_input):
+        self.handler_input = handler_input
+        self.ha_state: Union[Notification, ErrorResult, None] = None
+        self.queue: Optional[NotificationQueue] = None
+        self.prefetched_next = False
+        self.batch: Optional[dict] = None
+        handler_input.attributes_manager.request_attributes[HA_REQUEST_ATTRIBUTE] = self
 
         # Gets data from language_strings.json file according to the locale
         self.language_strings = self.handler_input.attributes_manager.request_attributes["_"]
 
-        self.token = self._fetch_token() if TOKEN == "" else TOKEN
+        self.metrics = request_metrics(handler_input)
+        with self.metrics.measure('Token'):
+            self.user_id = self.handler_input.request_envelope.context.system.user.user_id
+            self.home = HOMES.home_for(self.user_id)
+            token = self._fetch_token() if self.home.token == "" else self.home.token
+            self.token = TOKENS.resolve(self.user_id, token)
+
+        if not self._load_session_state():
+            self.get_ha_state()
+
+    @classmethod
+    def for_request(cls, handler_input) -> 'HomeAssistant':
+        """Get the HomeAssistant object of this request, creating it if needed."""
+        ha_obj = handler_input.attributes_manager.request_attributes.get(HA_REQUEST_ATTRIBUTE)
+        return ha_obj if ha_obj is not None else cls(handler_input)
+
+    def _session_attributes(self) -> Optional[dict]:
+        if self.handler_input.request_envelope.session is None:
+            return None
+        return self.handler_input.attributes_manager.session_attributes
+
+    def _load_session_state(self) -> bool:
+        """
+            Reuse the notification fetched earlier in this Alexa session, which
+            saves answer intents a GET request before posting their event.
+        """
+
+        session_attr = self._session_attributes()
+        if not session_attr or not session_attr.get(SESSION_HA_STATE):
+            return False
 
-        self.get_ha_state()
+        debug("Using Home Assistant state cached in the session")
+        self.ha_state = Notification.from_session(session_attr[SESSION_HA_STATE])
+        self.batch = session_attr.get(SESSION_BATCH)
+        debug('Home Assistant state: %r', self.ha_state)
+        return True
+
+    def _save_session_state(self) -> None:
+        session_attr = self._session_attributes()
+        if session_attr is None or not self.ha_state.event_id:
+            return
+
+        session_attr[SESSION_HA_STATE] = self.ha_state.to_session()
+        if self.batch is not None:
+            session_attr[SESSION_BATCH] = self.batch
 
     def clear_state(self):
         """
             Clear the state of the local Home Assistant object.
         """
 
-        logger.debug("Clearing Home Assistant local state")
+        debug("Clearing Home Assistant local state")
         self.ha_state = None
+        self.batch = None
+
+        session_attr = self._session_attributes()
+        if session_attr:
+            session_attr.pop(SESSION_HA_STATE, None)
+            session_attr.pop(SESSION_BATCH, None)
 
     def _fetch_token(self):
-        logger.debug("Fetching Home Assistant token from Alexa")
+        debug("Fetching Home Assistant token from Alexa")
         return get_account_linking_access_token(self.handler_input)
 
-    def _check_response_errors(self, response: HTTPResponse) -> Union[bool, str]:
+    def _send(self, phase: str, request, *args, idempotent: bool = False) -> TransportResponse:
+        """
+            Run a transport request with the token of this request, unless it is known to be
+            rejected. Failed attempts are retried up to HTTP_RETRIES times, as long as the
+            time left to answer Alexa allows another one. Requests that aren't idempotent are
+            only retried when they could not connect, and so were never sent.
+        """
+
+        if TOKENS.is_rejected(self.user_id, self.token):
+            debug("Skipping Home Assistant request, the access token is missing or was rejected")
+            self.metrics.http_status = 401
+            return TransportResponse(401, b'Access token missing or rejected earlier')
+
+        if not self.home.breaker.allow():
+            debug("Skipping Home Assistant request, it is unreachable")
+            self.metrics.http_status = 503
+            return TransportResponse(503, b'Home Assistant unreachable, circuit open')
+
+        try:
+            with self.metrics.measure(phase):
+                response = self._attempt(request, args, idempotent)
+        except (urllib3.exceptions.HTTPError, OSError) as error:
+            logger.error(f'Could not reach Home Assistant: {error}')
+            flush_debug_log('Home Assistant unreachable')
+            self.home.breaker.record_failure()
+            self.metrics.http_status = 503
+            return TransportResponse(503, str(error).encode('utf-8'))
+        except Exception:
+            # Whatever went wrong, a half open circuit must not wait on this trial forever
+            self.home.breaker.record_failure()
+            raise
+
+        if response.status >= 500:
+            self.home.breaker.record_failure()
+        else:
+            self.home.breaker.record_success()
+        self.metrics.http_status = response.status
+        TOKENS.record(self.user_id, self.token, response.status)
+        return response
+
+    def _attempt(self, request, args: tuple, idempotent: bool) -> TransportResponse:
+        """Try a request until it succeeds, or can't be retried, all within one deadline."""
+        for attempt in range(HTTP_RETRIES + 1):
+            try:
+                timeout = request_timeout(self.handler_input, self.metrics.started, self.home)
+                return request(*args, self.token, timeout=timeout)
+            except (urllib3.exceptions.HTTPError, OSError) as error:
+                backoff = HTTP_BACKOFF_FACTOR * 2 ** attempt
+                retryable = idempotent or isinstance(error, urllib3.exceptions.ConnectTimeoutError)
+                left = remaining_time(self.handler_input, self.metrics.started) - backoff
+                if attempt == HTTP_RETRIES or not retryable or left < RETRY_MIN_TIME:
+                    raise
+                debug('Retrying Home Assistant request in %.2fs: %s', backoff, error)
+                time.sleep(backoff)
+
+    def _check_response_errors(self, response: TransportResponse) -> Union[bool, str]:
+        if response.status < 400:
+            return False
+
+        logger.error(f'{response.status} Error from Home Assistant.')
+        # Error pages can be large, the start of the body tells what went wrong
+        debug('Response body: %.500r', response.data)
+        flush_debug_log(f'{response.status} Error from Home Assistant')
         if response.status == 401:
-            logger.error(f'401 Error from Home Assistant. Activate debug mode to see more details.')
-            logger.debug(response.data)
             speak_output = "Error 401 " + self.language_strings[prompts.ERROR_401]
             return speak_output
         if response.status == 404:
-            logger.error(f'404 Error from Home Assistant. Activate debug mode to see more details.')
-            logger.debug(response.data)
             speak_output = "Error 404 " + self.language_strings[prompts.ERROR_404]
             return speak_output
-        if response.status >= 400:
-            logger.error(f'{response.status} Error from Home Assistant. '
-                         f'Activate debug mode to see more details.')
-            logger.debug(response.data)
-            speak_output = f'Error {response.status}, {self.language_strings[prompts.ERROR_400]}'
-            return speak_output
-
-        return False
+        speak_output = f'Error {response.status}, {self.language_strings[prompts.ERROR_400]}'
+        return speak_output
 
     def get_ha_state(self) -> None:
         """
@@ -107,67 +1392,64 @@ class HomeAssistant(Borg):
             latest state from the Home Assistant server.
         """
 
-        http = urllib3.PoolManager(
-            cert_reqs='CERT_REQUIRED' if VERIFY_SSL else 'CERT_NONE',
-            timeout=urllib3.Timeout(connect=10.0, read=10.0)
-        )
+        self.ha_state = self.fetch_ha_state()
+        debug('Home Assistant state: %r', self.ha_state)
+        if BATCH_ANSWERS and self.queue is not None and self.ha_state.event_id:
+            self._start_batch()
+        self._save_session_state()
 
-        response = http.request(
-            'GET',
-            f'{HOME_ASSISTANT_URL}/api/states/{INPUT_TEXT_ENTITY}',
-            headers={
-                'Authorization': f'Bearer {self.token}',
-                'Content-Type': 'application/json'
-            },
-        )
+    def fetch_ha_state(self,
+                       skip_event_id: Optional[str] = None) -> Union[Notification, ErrorResult]:
+        """
+            Get the latest notification from the Home Assistant server,
+            without touching the local state.
+
+            :param skip_event_id: Event of a notification just answered, that a notification
+                queue might still hold. It is passed over for the next one.
+        """
+
+        response = self._send('HomeAssistantGet', self.home.transport.get_state,
+                              NOTIFICATION_QUEUE_ENTITY or INPUT_TEXT_ENTITY, idempotent=True)
 
         errors: Union[bool, str] = self._check_response_errors(response)
         if errors:
-            self.ha_state = {
-                "error": True,
-                "text": errors
-            }
-            logger.debug(self.ha_state)
-            return
-
-        decoded_response: Union[str, bytes] = json.loads(response.data.decode('utf-8')).get('state')
-        if not decoded_response:
+            return ErrorResult(errors)
+
+        if NOTIFICATION_QUEUE_ENTITY:
+            notifications = self.home.notification_cache.decode(
+                NOTIFICATION_QUEUE_ENTITY, response, queued_notifications)
+            return self._next_queued_state(notifications, skip_event_id)
+
+        try:
+            state: Optional[Notification] = self.home.notification_cache.decode(
+                INPUT_TEXT_ENTITY, response, decode_notification)
+        except ValueError as error:
+            logger.error(f'Invalid notification in {INPUT_TEXT_ENTITY}: {error}')
+            return ErrorResult(self.language_strings[prompts.ERROR_CONFIG])
+        if state is None:
             logger.error("No entity state provided by Home Assistant. "
                          "Did you forget to add the actionable notification entity?")
-            self.ha_state = {
-                "error": True,
-                "text": self.language_strings[prompts.ERROR_CONFIG]
-            }
-            logger.debug(self.ha_state)
-            return
+            return ErrorResult(self.language_strings[prompts.ERROR_CONFIG])
 
-        response_json = json.loads(decoded_response)
-        self.ha_state = {
-            "error": False,
-            "event_id": response_json.get('event'),
-            "text": response_json.get('text'),
-            "confirmation_text": response_json.get('confirmation_text'),
-            "response_text": response_json.get('response_text')
-        }
-        logger.debug(self.ha_state)
+        return state
 
-    def post_ha_event(self, event_response: str, event_response_type: str, **kwargs) -> str:
-        """
-            Posts an event to the Home Assistant server.
+    def _device_id(self) -> Optional[str]:
+        device = self.handler_input.request_envelope.context.system.device
+        return device.device_id if device else None
 
-            :param event_response: The response to send to the Home Assistant server.
-            :param event_response_type: The type of response to send to the Home Assistant server.
-            :param kwargs: Additional parameters to send to the Home Assistant server.
-            :return: The text to speak to the user.
-        """
+    def _next_queued_state(self, notifications: list, skip_event_id: Optional[str]) -> Notification:
+        self.queue = NotificationQueue(notifications)
+        notification = self.queue.next_for(self._device_id(), skip_event_id)
+        debug('%d queued notifications', len(self.queue))
 
-        http = urllib3.PoolManager(
-            cert_reqs='CERT_REQUIRED' if VERIFY_SSL else 'CERT_NONE',
-            timeout=urllib3.Timeout(connect=10.0, read=10.0)
-        )
+        if notification is None:
+            return Notification(None, self.language_strings[prompts.NO_NOTIFICATION])
+        return Notification.from_home_assistant(notification)
 
+    def _event_data(self, event_response: str, event_response_type: str, **kwargs) -> dict:
+        """Event data answering the current notification."""
         request_body = {
-            "event_id": self.ha_state.get('event_id'),
+            "event_id": self.ha_state.event_id,
             "event_response": event_response,
             "event_response_type": event_response_type
         }
@@ -176,28 +1458,142 @@ class HomeAssistant(Borg):
         if self.handler_input.request_envelope.context.system.person:
             person_id = self.handler_input.request_envelope.context.system.person.person_id
             request_body['event_person_id'] = person_id
+        return request_body
 
-        http_response = http.request(
-            'POST',
-            f'{HOME_ASSISTANT_URL}/api/events/alexa_actionable_notification',
-            headers={
-                'Authorization': f'Bearer {self.token}',
-                'Content-Type': 'application/json'
-            },
-            body=json.dumps(request_body).encode('utf-8')
-        )
-
+    def _answer_speech(self, event_response: str) -> str:
+        speak_output: str = self.ha_state.response_text or ""
+        if speak_output:
+            return speak_output.replace("<response>", str(event_response))
+        return self.language_strings[prompts.OKAY]
+
+    def _fire_event(self, event_type: str, event_data: dict,
+                    key: Optional[str] = None) -> Union[bool, str]:
+        """Post an event, or hand it to the outbox. Returns the error to speak, if any."""
+        if OUTBOX is not None and not TOKENS.is_rejected(self.user_id, self.token):
+            # The configured token of the Home is looked up again on delivery, it isn't saved
+            OUTBOX.put(event_data, None if self.home.token else self.token, self.user_id,
+                       event_type, key)
+            self.home.notification_cache.invalidate()
+            return False
+
+        http_response = self._send('HomeAssistantPost', self.home.transport.fire_event,
+                                   event_type, event_data)
         error: Union[bool, str] = self._check_response_errors(http_response)
+        if not error:
+            self.home.notification_cache.invalidate()
+        return error
+
+    def post_ha_event(self, event_response: str, event_response_type: str, **kwargs) -> str:
+        """
+            Posts an event to the Home Assistant server.
+
+            :param event_response: The response to send to the Home Assistant server.
+            :param event_response_type: The type of response to send to the Home Assistant server.
+            :param kwargs: Additional parameters to send to the Home Assistant server.
+            :return: The text to speak to the user.
+        """
+
+        request_body = self._event_data(event_response, event_response_type, **kwargs)
+        error: Union[bool, str] = self._fire_event(EVENT_TYPE, request_body)
         if error:
             return error
 
-        speak_output: str = self.ha_state.get('response_text') or ""
-        if speak_output:
-            speak_output = speak_output.replace("<response>", event_response)
-        else:
-            speak_output = self.language_strings[prompts.OKAY]
+        speak_output = self._answer_speech(event_response)
+        self.clear_state()
+        return speak_output
+
+    def _start_batch(self) -> None:
+        """Keep the other queued notifications in the session, to ask them one after another."""
+        pending = [Notification.from_home_assistant(notification).to_session()
+                   for notification in self.queue.pending_for(self._device_id())
+                   if notification.get('event') != self.ha_state.event_id]
+        self.batch = {"pending": pending, "answers": []}
+        debug('Batch of %d notifications', len(pending) + 1)
+
+    def record_answer(self, event_response: str, event_response_type: str, **kwargs) -> str:
+        """
+            Keep the answer to the current notification for flush_batch, and move on to the
+            next pending notification, if there is one.
 
+            :return: The text to speak to the user.
+        """
+
+        answer = self._event_data(event_response, event_response_type, **kwargs)
+        self.batch['answers'].append(answer)
+        speak_output = self._answer_speech(event_response)
+        if self.batch['pending']:
+            self.ha_state = Notification.from_session(self.batch['pending'].pop(0))
+            self.prefetched_next = True
+            self._save_session_state()
+        return speak_output
+
+    def flush_batch(self) -> Union[bool, str]:
+        """
+            Post the answers collected in this session as a single BATCH_EVENT_TYPE event,
+            whose "answers" list holds the event data of each answer, then clear the state.
+
+            :return: The error to speak, if any.
+        """
+
+        answers = self.batch['answers'] if self.batch else []
+        if answers:
+            key = '+'.join(str(answer['event_id']) for answer in answers)
+            error: Union[bool, str] = self._fire_event(BATCH_EVENT_TYPE, {"answers": answers}, key)
+            if error:
+                return error
         self.clear_state()
+        return False
+
+    def _submit(self, func, *args, **kwargs) -> Future:
+        """Run a call on the I/O executor, in a copy of the context of the request."""
+        context = contextvars.copy_context()
+        return IO_EXECUTOR.submit(context.run, functools.partial(func, *args, **kwargs))
+
+    def answer(self, event_response: str, event_response_type: str, **kwargs) -> str:
+        """
+            Posts the user's answer to the Home Assistant server. With PREFETCH_NEXT_NOTIFICATION
+            and a NOTIFICATION_QUEUE_ENTITY the next notification is read while the event is
+            posted, see answer_prefetching. In a batch the answer is only posted with the last one,
+            see record_answer.
+
+            :return: The text to speak to the user.
+        """
+
+        if self.batch is not None:
+            speak_output = self.record_answer(event_response, event_response_type, **kwargs)
+            if self.prefetched_next:
+                return speak_output
+            return self.flush_batch() or speak_output
+
+        if not PREFETCH_NEXT_NOTIFICATION or not NOTIFICATION_QUEUE_ENTITY:
+            # INPUT_TEXT_ENTITY only holds the notification being answered, there is no next one
+            return self.post_ha_event(event_response, event_response_type, **kwargs)
+
+        return self.answer_prefetching(event_response, event_response_type, **kwargs)
+
+    def answer_prefetching(self, event_response: str, event_response_type: str,
+                           **kwargs) -> str:
+        """
+            Posts the user's answer and reads the notification queue concurrently, both on the
+            I/O executor. If the queue already holds a different notification it becomes the
+            local state, so the handler can ask it in the same session instead of waiting for
+            a new launch.
+
+            :return: The text to speak to the user.
+        """
+
+        answered_event_id = self.ha_state.event_id
+        posted = self._submit(self.post_ha_event, event_response, event_response_type, **kwargs)
+        fetched = self._submit(self.fetch_ha_state, answered_event_id)
+        speak_output, next_state = posted.result(), fetched.result()
+
+        # post_ha_event only clears the state once the event was delivered
+        if self.ha_state is None and not next_state.error and \
+                next_state.event_id and next_state.event_id != answered_event_id:
+            debug('Next notification: %r', next_state)
+            self.ha_state = next_state
+            self.prefetched_next = True
+            self._save_session_state()
         return speak_output
 
     def get_value_for_slot(self, slot_name):
@@ -211,9 +1607,98 @@ class HomeAssistant(Borg):
                             return value.value.name
 
 
+class StaticResponses:
+    """
+        Responses made only of fixed text, like the stop message or the configuration errors,
+        built once and shared by every request along with their serialized form, see
+        ResponseSerializer. Nothing, response interceptors included, may modify them.
+
+        Only the first max_size different texts are kept, the others are built every time.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._responses = {}  # (speech, reprompt) -> Response
+        self._serialized = {}  # id(Response) -> dict
+        self._serializer = DefaultSerializer()
+        self._lock = Lock()
+
+    def get(self, speech: str, reprompt: Optional[str] = None):
+        """The response speaking speech, and keeping the session open with reprompt if given."""
+        key = (speech, reprompt)
+        response = self._responses.get(key)
+        if response is not None:
+            return response
+
+        builder = ResponseFactory().speak(speech)
+        if reprompt is not None:
+            builder.ask(reprompt)
+        response = builder.response
+        if len(self._responses) < self.max_size:
+            serialized = self._serializer.serialize(response)
+            with self._lock:
+                if key not in self._responses:
+                    self._serialized[id(response)] = serialized
+                response = self._responses.setdefault(key, response)
+        return response
+
+    def serialized(self, response) -> Optional[dict]:
+        return self._serialized.get(id(response))
+
+
+STATIC_RESPONSES = StaticResponses(256)
+
+
+class ResponseSerializer(DefaultSerializer):
+    """
+        Serializer of the skill: it reuses the serialized form of the StaticResponses, and
+        deserializes request envelopes with the JSON codec, or straight from the event
+        Lambda already decoded.
+    """
+
+    def deserialize(self, payload, obj_type):
+        if isinstance(payload, (str, bytes)):
+            try:
+                payload = json_loads(payload)
+            except ValueError:
+                raise SerializationException(f"Couldn't parse response body: {payload}")
+        # The dict to model conversion of DefaultSerializer.deserialize, ask-sdk-core is pinned
+        return self._DefaultSerializer__deserialize(payload, obj_type)
+
+    def serialize(self, obj):
+        if isinstance(obj, ResponseEnvelope):
+            serialized = STATIC_RESPONSES.serialized(obj.response)
+            if serialized is not None:
+                envelope = {"version": obj.version, "response": serialized}
+                if obj.session_attributes is not None:
+                    envelope["sessionAttributes"] = super().serialize(obj.session_attributes)
+                if obj.user_agent is not None:
+                    envelope["userAgent"] = obj.user_agent
+                return envelope
+        return super().serialize(obj)
+
+
+def build_answer_response(handler_input, ha_obj: HomeAssistant, speak_output: str):
+    """Build the response to an answer, asking the next notification if one was prefetched."""
+    if ha_obj.prefetched_next:
+        return (
+            handler_input.response_builder
+                .speak(f"{speak_output}. {ha_obj.ha_state.text}")
+                .ask('')
+                .response
+        )
+    return (
+        handler_input.response_builder
+            .speak(speak_output)
+            .response
+    )
+
+
 class LaunchRequestHandler(AbstractRequestHandler):
     """Handler for Skill Launch."""
 
+    request_type = 'LaunchRequest'
+
     def can_handle(self, handler_input):
         """Check for Launch Request."""
         return is_request_type('LaunchRequest')(handler_input)
@@ -221,8 +1706,8 @@ class LaunchRequestHandler(AbstractRequestHandler):
     def handle(self, handler_input):
         """Handler for Skill Launch."""
         ha_obj = HomeAssistant(handler_input)
-        speak_output: Optional[str] = ha_obj.ha_state['text']
-        event_id: Optional[str] = ha_obj.ha_state['event_id']
+        speak_output: Optional[str] = ha_obj.ha_state.text
+        event_id: Optional[str] = ha_obj.ha_state.event_id
 
         if event_id:
             return (
@@ -233,16 +1718,15 @@ class LaunchRequestHandler(AbstractRequestHandler):
             )
         else:
             ha_obj.clear_state()
-            return (
-                handler_input.response_builder
-                    .speak(speak_output)
-                    .response
-            )
+            return STATIC_RESPONSES.get(speak_output)
 
 
 class YesIntentHandler(AbstractRequestHandler):
     """Handler for Yes Intent."""
 
+    request_type = 'IntentRequest'
+    intent_names = ('AMAZON.YesIntent',)
+
     def can_handle(self, handler_input):
         """Check for Yes Intent."""
         return is_intent_name('AMAZON.YesIntent')(handler_input)
@@ -255,22 +1739,21 @@ class YesIntentHandler(AbstractRequestHandler):
         # Check if we are confirming a response
         session_attr = handler_input.attributes_manager.session_attributes
         if session_attr.get('unconfirmedResponse'):
-            strings = session_attr.get('unconfirmedResponse')
-            logger.debug(f'Confirmed String: {strings}')
-            speak_output = ha_obj.post_ha_event(strings, RESPONSE_STRING)
+            strings = session_attr.pop('unconfirmedResponse')
+            debug('Confirmed String: %s', strings)
+            speak_output = ha_obj.answer(strings, RESPONSE_STRING)
         else:
-            speak_output = ha_obj.post_ha_event(RESPONSE_YES, RESPONSE_YES)
+            speak_output = ha_obj.answer(RESPONSE_YES, RESPONSE_YES)
 
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .response
-        )
+        return build_answer_response(handler_input, ha_obj, speak_output)
 
 
 class NoIntentHandler(AbstractRequestHandler):
     """Handler for No Intent."""
 
+    request_type = 'IntentRequest'
+    intent_names = ('AMAZON.NoIntent',)
+
     def can_handle(self, handler_input):
         """Check for No Intent."""
         return is_intent_name('AMAZON.NoIntent')(handler_input)
@@ -284,9 +1767,9 @@ class NoIntentHandler(AbstractRequestHandler):
         session_attr = handler_input.attributes_manager.session_attributes
         if session_attr.get('unconfirmedResponse'):
             session_attr["unconfirmedResponse"] = None
-            speak_output: Optional[str] = ha_obj.ha_state['text']
+            speak_output: Optional[str] = ha_obj.ha_state.text
             speak_output = f"{ha_obj.language_strings[prompts.OKAY]}. {speak_output}"
-            event_id: Optional[str] = ha_obj.ha_state['event_id']
+            event_id: Optional[str] = ha_obj.ha_state.event_id
 
             if event_id:
                 return (
@@ -303,18 +1786,17 @@ class NoIntentHandler(AbstractRequestHandler):
                         .response
                 )
 
-        speak_output = ha_obj.post_ha_event(RESPONSE_NO, RESPONSE_NO)
+        speak_output = ha_obj.answer(RESPONSE_NO, RESPONSE_NO)
 
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .response
-        )
+        return build_answer_response(handler_input, ha_obj, speak_output)
 
 
 class NumericIntentHandler(AbstractRequestHandler):
     """Handler for Select Intent."""
 
+    request_type = 'IntentRequest'
+    intent_names = ('Number',)
+
     def can_handle(self, handler_input):
         """Check for Select Intent."""
         return is_intent_name('Number')(handler_input)
@@ -324,21 +1806,20 @@ class NumericIntentHandler(AbstractRequestHandler):
         logger.info('Numeric Intent Handler triggered')
         ha_obj = HomeAssistant(handler_input)
         number = get_slot_value(handler_input, 'Numbers')
-        logger.debug(f'Number: {number}')
+        debug('Number: %s', number)
         if number == '?':
             raise
-        speak_output = ha_obj.post_ha_event(number, RESPONSE_NUMERIC)
+        speak_output = ha_obj.answer(number, RESPONSE_NUMERIC)
 
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .response
-        )
+        return build_answer_response(handler_input, ha_obj, speak_output)
 
 
 class StringIntentHandler(AbstractRequestHandler):
     """Handler for String Intent."""
 
+    request_type = 'IntentRequest'
+    intent_names = ('String',)
+
     def can_handle(self, handler_input):
         """Check for Select Intent."""
         return is_intent_name('String')(handler_input)
@@ -348,10 +1829,10 @@ class StringIntentHandler(AbstractRequestHandler):
         logger.info('String Intent Handler triggered')
         ha_obj = HomeAssistant(handler_input)
         strings = get_slot_value(handler_input, 'Strings')
-        logger.debug(f'String: {strings}')
+        debug('String: %s', strings)
 
-        if ha_obj.ha_state and ha_obj.ha_state.get('confirmation_text'):
-            speak_output: str = ha_obj.ha_state['confirmation_text'] or ""
+        if ha_obj.ha_state and ha_obj.ha_state.confirmation_text:
+            speak_output: str = ha_obj.ha_state.confirmation_text
             speak_output = speak_output.replace("<response>", strings)
 
             session_attr = handler_input.attributes_manager.session_attributes
@@ -364,18 +1845,17 @@ class StringIntentHandler(AbstractRequestHandler):
                     .response
             )
 
-        speak_output = ha_obj.post_ha_event(strings, RESPONSE_STRING)
+        speak_output = ha_obj.answer(strings, RESPONSE_STRING)
 
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .response
-        )
+        return build_answer_response(handler_input, ha_obj, speak_output)
 
 
 class SelectIntentHandler(AbstractRequestHandler):
     """Handler for Select Intent."""
 
+    request_type = 'IntentRequest'
+    intent_names = ('Select',)
+
     def can_handle(self, handler_input):
         """Check for Select Intent."""
         return is_intent_name('Select')(handler_input)
@@ -385,25 +1865,24 @@ class SelectIntentHandler(AbstractRequestHandler):
         logger.info('Selection Intent Handler triggered')
         ha_obj = HomeAssistant(handler_input)
         selection = ha_obj.get_value_for_slot('Selections')
-        logger.debug(f'Selection: {selection}')
+        debug('Selection: %s', selection)
 
         if not selection:
             raise
 
-        ha_obj.post_ha_event(selection, RESPONSE_SELECT)
+        ha_obj.answer(selection, RESPONSE_SELECT)
         data = handler_input.attributes_manager.request_attributes["_"]
         speak_output = data[prompts.SELECTED].format(selection)
 
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .response
-        )
+        return build_answer_response(handler_input, ha_obj, speak_output)
 
 
 class DurationIntentHandler(AbstractRequestHandler):
     """Handler for Duration Intent."""
 
+    request_type = 'IntentRequest'
+    intent_names = ('Duration',)
+
     def can_handle(self, handler_input):
         """Check for Duration Intent."""
         return is_intent_name('Duration')(handler_input)
@@ -414,21 +1893,19 @@ class DurationIntentHandler(AbstractRequestHandler):
         ha_obj = HomeAssistant(handler_input)
         duration = get_slot_value(handler_input, 'Durations')
 
-        logger.debug(f'Duration: {duration}')
+        debug('Duration: %s', duration)
 
-        speak_output = ha_obj.post_ha_event(
-            isodate.parse_duration(duration).total_seconds(), RESPONSE_DURATION)
+        speak_output = ha_obj.answer(duration_seconds(duration), RESPONSE_DURATION)
 
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .response
-        )
+        return build_answer_response(handler_input, ha_obj, speak_output)
 
 
 class DateTimeIntentHandler(AbstractRequestHandler):
     """Handler for Date Time Intent."""
 
+    request_type = 'IntentRequest'
+    intent_names = ('Date',)
+
     def can_handle(self, handler_input):
         """Check for Date Time Intent."""
         return is_intent_name('Date')(handler_input)
@@ -440,8 +1917,8 @@ class DateTimeIntentHandler(AbstractRequestHandler):
         dates = get_slot_value(handler_input, 'Dates')
         times = get_slot_value(handler_input, 'Times')
 
-        logger.debug(f'Dates: {dates}')
-        logger.debug(f'Times: {times}')
+        debug('Dates: %s', dates)
+        debug('Times: %s', times)
 
         if not dates and not times:
             raise
@@ -449,17 +1926,15 @@ class DateTimeIntentHandler(AbstractRequestHandler):
         data = handler_input.attributes_manager.request_attributes["_"]
         speak_output = data[prompts.ERROR_SPECIFIC_DATE]
 
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .ask('')
-                .response
-        )
+        return STATIC_RESPONSES.get(speak_output, '')
 
 
 class CancelOrStopIntentHandler(AbstractRequestHandler):
     """Single handler for Cancel and Stop Intent."""
 
+    request_type = 'IntentRequest'
+    intent_names = ('AMAZON.CancelIntent', 'AMAZON.StopIntent')
+
     def can_handle(self, handler_input):
         """Check for Cancel and Stop Intent."""
         return (is_intent_name('AMAZON.CancelIntent')(handler_input) or
@@ -471,16 +1946,18 @@ class CancelOrStopIntentHandler(AbstractRequestHandler):
         data = handler_input.attributes_manager.request_attributes["_"]
         speak_output = data[prompts.STOP_MESSAGE]
 
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .response
-        )
+        # Post what was answered before stopping
+        if handler_input.attributes_manager.session_attributes.get(SESSION_BATCH):
+            speak_output = HomeAssistant(handler_input).flush_batch() or speak_output
+
+        return STATIC_RESPONSES.get(speak_output)
 
 
 class SessionEndedRequestHandler(AbstractRequestHandler):
     """Handler for Session End."""
 
+    request_type = 'SessionEndedRequest'
+
     def can_handle(self, handler_input):
         """Check for Session End."""
         return is_request_type('SessionEndedRequest')(handler_input)
@@ -490,7 +1967,11 @@ class SessionEndedRequestHandler(AbstractRequestHandler):
         logger.info('Session Ended Request Handler triggered')
         ha_obj = HomeAssistant(handler_input)
         reason = handler_input.request_envelope.request.reason
-        if reason == SessionEndedReason.EXCEEDED_MAX_REPROMPTS:
+        if ha_obj.batch is not None:
+            if reason == SessionEndedReason.EXCEEDED_MAX_REPROMPTS:
+                ha_obj.record_answer(RESPONSE_NONE, RESPONSE_NONE)
+            ha_obj.flush_batch()
+        elif reason == SessionEndedReason.EXCEEDED_MAX_REPROMPTS:
             ha_obj.post_ha_event(RESPONSE_NONE, RESPONSE_NONE)
 
         return handler_input.response_builder.response
@@ -503,6 +1984,8 @@ class IntentReflectorHandler(AbstractRequestHandler):
     handler chain below.
     """
 
+    request_type = 'IntentRequest'
+
     def can_handle(self, handler_input):
         """Check if can handle IntentReflectorHandler."""
         return is_request_type('IntentRequest')(handler_input)
@@ -535,23 +2018,57 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
         """Handle exception."""
         logger.info('Catch All Exception triggered')
         logger.error(exception, exc_info=True)
-        ha_obj = HomeAssistant()
+        flush_debug_log('Request failed')
+        try:
+            ha_state = HomeAssistant.for_request(handler_input).ha_state
+        except Exception as error:
+            # The exception may come from reaching Home Assistant in the first place
+            logger.error(f'No Home Assistant state to repeat: {error}')
+            ha_state = None
+        emit_metrics(handler_input)
 
         data = handler_input.attributes_manager.request_attributes["_"]
-        if ha_obj.ha_state and ha_obj.ha_state.get('text'):
-            speak_output = data[prompts.ERROR_ACOUSTIC].format(ha_obj.ha_state.get('text'))
+        if ha_state is not None and ha_state.text:
+            speak_output = data[prompts.ERROR_ACOUSTIC].format(ha_state.text)
             return (
                 handler_input.response_builder
                     .speak(speak_output)
                     .ask('')
                     .response
             )
-        speak_output = data[prompts.ERROR_CONFIG].format(ha_obj.ha_state.get('text'))
-        return (
-            handler_input.response_builder
-                .speak(speak_output)
-                .response
-        )
+        return STATIC_RESPONSES.get(data[prompts.ERROR_CONFIG])
+
+
+def load_language_strings() -> Mapping[str, Mapping[str, str]]:
+    """
+        Build the string table for every locale in language_strings.json.
+
+        Each locale is resolved once against its fallback chain, so "fr-CA" holds the
+        "fr-CA" strings on top of "fr", on top of the default language.
+    """
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'language_strings.json')
+    with open(path, encoding='utf-8') as language_prompts:
+        language_data = json.load(language_prompts)
+
+    tables = {}
+    for locale in language_data:
+        data = dict(language_data[DEFAULT_LANGUAGE])
+        data.update(language_data.get(locale[:2], {}))
+        data.update(language_data[locale])
+        tables[locale] = MappingProxyType(data)
+    return MappingProxyType(tables)
+
+
+LANGUAGE_STRINGS = load_language_strings()
+
+
+def get_language_strings(locale: str) -> Mapping[str, str]:
+    """Get the string table for a locale, falling back to its language, then the default."""
+    strings = LANGUAGE_STRINGS.get(locale)
+    if strings is None:
+        strings = LANGUAGE_STRINGS.get(locale[:2], LANGUAGE_STRINGS[DEFAULT_LANGUAGE])
+    return strings
 
 
 class LocalizationInterceptor(AbstractRequestInterceptor):
@@ -559,30 +2076,131 @@ class LocalizationInterceptor(AbstractRequestInterceptor):
 
     def process(self, handler_input):
         """Load locale specific data."""
-        locale = handler_input.request_envelope.request.locale
-        logger.info(f'Locale is {locale[:2]}')
-
-        # localized strings stored in language_strings.json
-        with open('language_strings.json', encoding='utf-8') as language_prompts:
-            language_data = json.load(language_prompts)
-        # set default translation data to broader translation
-        data = language_data[locale[:2]]
-        # if a more specialized translation exists, then select it instead
-        # example: "fr-CA" will pick "fr" translations first, but if "fr-CA" translation exists,
-        #          then pick that instead
-        if locale in language_data:
-            data.update(language_data[locale])
-        handler_input.attributes_manager.request_attributes["_"] = data
+        with request_metrics(handler_input).measure('Localization'):
+            locale = handler_input.request_envelope.request.locale
+            logger.info(f'Locale is {locale[:2]}')
+
+            # localized strings are loaded once per container from language_strings.json
+            handler_input.attributes_manager.request_attributes["_"] = get_language_strings(locale)
+
+
+class DebugLogRequestInterceptor(AbstractRequestInterceptor):
+    """Start the DebugLog of the request, registered before any other interceptor."""
+
+    def process(self, handler_input):
+        """Replace the DebugLog of the previous request."""
+        start_debug_log()
+
+
+class MetricsRequestInterceptor(AbstractRequestInterceptor):
+    """Start measuring the request, registered right after the DebugLogRequestInterceptor."""
+
+    def process(self, handler_input):
+        """Attach fresh metrics to the request."""
+        request_attributes = handler_input.attributes_manager.request_attributes
+        request_attributes[METRICS_REQUEST_ATTRIBUTE] = RequestMetrics()
+
+
+class MetricsResponseInterceptor(AbstractResponseInterceptor):
+    """Emit the metrics of the request once its response is built."""
+
+    def process(self, handler_input, response):
+        """Emit the metrics."""
+        emit_metrics(handler_input)
+
+
+class MeasuredHandlerAdapter(GenericHandlerAdapter):
+    """Handler adapter recording which handler ran, and for how long."""
+
+    def execute(self, handler_input, handler):
+        """Execute the handler."""
+        metrics = request_metrics(handler_input)
+        metrics.handler = type(handler).__name__
+        with metrics.measure('Handler'):
+            return super().execute(handler_input, handler)
+
+
+class DispatchTable(GenericRequestMapper):
+    """
+        Request mapper routing on a dict built once from the registered handlers.
+
+        Handlers declare what they handle with a request_type and, for intents, the
+        intent_names class attributes. Requests are looked up by request type and intent
+        name; handlers without a request_type are checked with can_handle in registration
+        order, before the handlers taking a whole request type, like the IntentReflectorHandler.
+    """
+
+    def __init__(self, request_handler_chains):
+        super().__init__(request_handler_chains)
+        self.routes = {}
+        self.type_routes = {}
+        self.fallback_chains = []
+        for chain in self.request_handler_chains:
+            handler = chain.request_handler
+            request_type = getattr(handler, 'request_type', None)
+            intent_names = getattr(handler, 'intent_names', ())
+            if request_type is None:
+                self.fallback_chains.append(chain)
+            elif intent_names:
+                for intent_name in intent_names:
+                    self.routes.setdefault((request_type, intent_name), chain)
+            else:
+                self.routes.setdefault((request_type, None), chain)
+                self.type_routes.setdefault(request_type, chain)
+
+    def get_request_handler_chain(self, handler_input):
+        """Get the request handler chain that can handle the request."""
+        request = handler_input.request_envelope.request
+        intent = getattr(request, 'intent', None)
+        chain = self.routes.get((request.object_type, intent.name if intent else None))
+        if chain is not None:
+            return chain
+
+        for chain in self.fallback_chains:
+            if chain.request_handler.can_handle(handler_input=handler_input):
+                return chain
+        return self.type_routes.get(request.object_type)
+
+
+class MeasuredSkillBuilder(SkillBuilder):
+    """SkillBuilder routing through the DispatchTable and measuring handlers."""
+
+    @property
+    def skill_configuration(self):
+        """Create the skill configuration object using the registered components."""
+        skill_configuration = super().skill_configuration
+        skill_configuration.request_mappers = [
+            DispatchTable(mapper.request_handler_chains)
+            for mapper in skill_configuration.request_mappers]
+        skill_configuration.handler_adapters = [MeasuredHandlerAdapter()]
+        return skill_configuration
+
+    def create(self):
+        """Create the skill, serializing its responses with the ResponseSerializer."""
+        skill = super().create()
+        skill.serializer = ResponseSerializer()
+        return skill
+
+    def lambda_handler(self):
+        """Create the Lambda handler, with the skill and its dispatch table built only once."""
+        skill = self.create()
+
+        def wrapper(event, context):
+            request_envelope = skill.serializer.deserialize(payload=event, obj_type=RequestEnvelope)
+            response_envelope = skill.invoke(request_envelope=request_envelope, context=context)
+            return skill.serializer.serialize(response_envelope)
+        return wrapper
 
 
 """
     The SkillBuilder object acts as the entry point for your skill, routing all request and response
     payloads to the handlers above. Make sure any new handlers or interceptors you've
     defined are included below.
-    The order matters - they're processed top to bottom.
+    Handlers declaring a request_type are routed through the DispatchTable, the order matters
+    for the others - they're processed top to bottom.
 """
 
-sb = SkillBuilder()
+sb = MeasuredSkillBuilder()
 
 # register request / intent handlers
 sb.add_request_handler(LaunchRequestHandler())
@@ -600,7 +2218,114 @@ sb.add_request_handler(IntentReflectorHandler())
 # register exception handlers
 sb.add_exception_handler(CatchAllExceptionHandler())
 
-# register response interceptors
+# register request / response interceptors
+sb.add_global_request_interceptor(DebugLogRequestInterceptor())
+sb.add_global_request_interceptor(MetricsRequestInterceptor())
 sb.add_global_request_interceptor(LocalizationInterceptor())
+sb.add_global_response_interceptor(MetricsResponseInterceptor())
+
+skill_handler = sb.lambda_handler()
+
+# Import and initialization cost of this module, paid once per container
+MODULE_LOAD_TIME = time.perf_counter() - MODULE_LOAD_STARTED
+cold_start = True
+
+
+def log_cold_start_profile(first_request_time: float) -> None:
+    """Log where the time of a cold start went."""
+    slowest_first = sorted(IMPORT_TIMES.items(), key=lambda item: -item[1])
+    imports = ', '.join(f'{name} {seconds * 1000:.1f}ms' for name, seconds in slowest_first)
+    logger.info(f'Cold start: module load {MODULE_LOAD_TIME * 1000:.1f}ms ({imports}), '
+                f'first request {first_request_time * 1000:.1f}ms')
+
+
+def warm_up() -> dict:
+    """
+        Pay the first request costs ahead of time: import the lazily imported modules, load
+        the model classes the SDK deserializes envelopes into, build the static responses
+        of every locale, and connect to Home Assistant.
+    """
+
+    start = time.perf_counter()
+    import isodate  # noqa: F401
+    if HA_TRANSPORT == "websocket":
+        import ha_websocket  # noqa: F401
+
+    serializer = DefaultSerializer()
+    selections = {
+        "name": "Selections", "value": "warm up",
+        "resolutions": {"resolutionsPerAuthority": [
+            {"authority": "warm-up", "status": {"code": "ER_SUCCESS_MATCH"}, "values": []}]}
+    }
+    for request in ({"type": "LaunchRequest"},
+                    {"type": "SessionEndedRequest", "reason": "USER_INITIATED"},
+                    {"type": "IntentRequest",
+                     "intent": {"name": "Select", "slots": {"Selections": selections}}}):
+        serializer.deserialize(json.dumps({
+            "version": "1.0",
+            "session": {"new": True, "sessionId": "warm-up",
+                        "application": {"applicationId": "warm-up"},
+                        "attributes": {}, "user": {"userId": "warm-up"}},
+            "context": {"System": {"application": {"applicationId": "warm-up"},
+                                   "user": {"userId": "warm-up"},
+                                   "device": {"deviceId": "warm-up", "supportedInterfaces": {}}}},
+            "request": dict(request, requestId="warm-up", timestamp="2021-01-01T00:00:00Z",
+                            locale="en-US")
+        }), RequestEnvelope)
+
+    for data in LANGUAGE_STRINGS.values():
+        STATIC_RESPONSES.get(data[prompts.STOP_MESSAGE])
+        STATIC_RESPONSES.get(data[prompts.ERROR_SPECIFIC_DATE], '')
+        STATIC_RESPONSES.get(data[prompts.NO_NOTIFICATION])
+
+    try:
+        home = HOMES.home_for(None)
+    except UnroutedUserError:
+        home = None
+    if home is None:
+        debug('No default Home Assistant to connect to while warming up')
+    elif home.breaker.allow():
+        timeout = urllib3.Timeout(total=WARM_UP_TIMEOUT,
+                                  connect=min(home.connect_timeout, WARM_UP_TIMEOUT),
+                                  read=min(home.read_timeout, WARM_UP_TIMEOUT))
+        try:
+            status = home.transport.warm_up(TOKEN, timeout)
+        except (urllib3.exceptions.HTTPError, OSError) as error:
+            logger.warning(f'Could not reach Home Assistant while warming up: {error}')
+            home.breaker.record_failure()
+        except Exception:
+            home.breaker.record_failure()
+            raise
+        else:
+            if status >= 500:
+                home.breaker.record_failure()
+            else:
+                home.breaker.record_success()
+    else:
+        debug('Home Assistant circuit open, not connecting while warming up')
+
+    duration = (time.perf_counter() - start) * 1000
+    logger.info(f'Warmed up in {duration:.1f}ms')
+    return {"warmup": True, "duration_ms": round(duration, 1)}
+
+
+def lambda_handler(event, context):
+    """
+        Entry point for AWS Lambda. Events that aren't Alexa requests, like scheduled
+        EventBridge events, keep the container warm, see warm_up.
+    """
 
-lambda_handler = sb.lambda_handler()
+    global cold_start
+    if OUTBOX is not None:
+        # Deliver what the previous invocation left behind
+        OUTBOX.kick()
+    if 'request' not in event:
+        return warm_up()
+    if not (cold_start and PROFILE_COLD_START):
+        return skill_handler(event, context)
+
+    cold_start = False
+    start = time.perf_counter()
+    response = skill_handler(event, context)
+    log_cold_start_profile(time.perf_counter() - start)
+    return response
@@ -0,0 +1,188 @@
+"""
+    Serve the skill over HTTP instead of AWS Lambda, e.g. on the machine running Home Assistant.
+
+    Alexa only calls HTTPS endpoints: put the server behind a TLS reverse proxy, or pass
+    --certfile and --keyfile. The signature and timestamp of every request are verified
+    with the ask-sdk-webservice-support package (pip install -r requirements-server.txt);
+    --no-verify skips that, for local load tests only.
+
+    Connections are kept alive and served by a pool of --threads threads, in each of
+    --workers processes sharing the listening socket. With ASYNC_EVENTS, every worker
+    queues its events in its own outbox file, OUTBOX_PATH suffixed with the worker index.
+
+    Usage: python local_server.py [--host 0.0.0.0] [--port 8080] [--threads 16] [--workers 1]
+                                  [--keep-alive 30] [--certfile cert.pem --keyfile key.pem]
+                                  [--no-verify]
+"""
+import os
+import ssl
+import sys
+import signal
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from ask_sdk_core.exceptions import AskSdkException
+from ask_sdk_model import RequestEnvelope
+
+import lambda_function
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.setLevel(logging.INFO)
+
+
+class SkillHTTPServer(HTTPServer):
+    """HTTP server handing each connection to a bounded thread pool."""
+
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, verify: bool = True, threads: int = 16, keep_alive: float = 30.0):
+        super().__init__(address, SkillRequestHandler)
+        self.keep_alive = keep_alive
+        self.threads = threads
+        self.executor: ThreadPoolExecutor = None
+        self.skill = lambda_function.sb.create()
+        self.verifiers = []
+        if verify:
+            try:
+                from ask_sdk_webservice_support.verifier import RequestVerifier, TimestampVerifier
+            except ImportError:
+                self.server_close()
+                raise ImportError('Verifying Alexa requests needs the ask-sdk-webservice-support '
+                                  'package: pip install -r requirements-server.txt, or pass '
+                                  '--no-verify for local load tests') from None
+            self.verifiers = [RequestVerifier(), TimestampVerifier()]
+
+    def serve_forever(self, poll_interval=0.5):
+        # Created here, so that each worker process gets its own threads
+        self.executor = ThreadPoolExecutor(max_workers=self.threads,
+                                           thread_name_prefix='skill-server')
+        if lambda_function.OUTBOX is not None:
+            lambda_function.OUTBOX.kick()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            logger.exception(f'Error serving {client_address[0]}')
+
+    def dispatch(self, headers: dict, body: str) -> dict:
+        """Verify a request envelope and run it through the skill, returns the response envelope."""
+        request_envelope = self.skill.serializer.deserialize(payload=body, obj_type=RequestEnvelope)
+        for verifier in self.verifiers:
+            verifier.verify(headers=headers, serialized_request_env=body,
+                            deserialized_request_env=request_envelope)
+
+        response_envelope = self.skill.invoke(request_envelope=request_envelope, context=None)
+        return self.skill.serializer.serialize(response_envelope)
+
+
+class SkillRequestHandler(BaseHTTPRequestHandler):
+    """Answer Alexa requests POSTed to any path, over persistent connections."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: SkillHTTPServer
+
+    def setup(self):
+        # Idle keep-alive connections give their thread back after this many seconds
+        self.timeout = self.server.keep_alive
+        super().setup()
+
+    def log_message(self, format, *args):
+        logger.debug('%s ' + format, self.address_string(), *args)
+
+    def _send(self, status: int, body: dict) -> None:
+        data = lambda_function.json_dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._send(200, {"status": "ok"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        try:
+            response = self.server.dispatch(dict(self.headers), body)
+        except AskSdkException as error:
+            logger.warning(f'Rejected request from {self.address_string()}: {error}')
+            return self._send(400, {"message": str(error)})
+        self._send(200, response)
+
+
+def serve(server: SkillHTTPServer, workers: int) -> None:
+    """Serve from this process and workers - 1 forked ones, all accepting on the same socket."""
+    children = []
+    for index in range(1, workers):
+        pid = os.fork()
+        if pid == 0:
+            children = None
+            if lambda_function.OUTBOX is not None:
+                lambda_function.OUTBOX = lambda_function.OUTBOX.for_worker(index)
+            break
+        children.append(pid)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children or ():
+            os.kill(pid, signal.SIGTERM)
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the skill over HTTP.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--threads', type=int, default=16,
+                        help='connections served at once, per worker')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes sharing the listening socket')
+    parser.add_argument('--keep-alive', type=float, default=30.0,
+                        help='seconds an idle connection is kept open')
+    parser.add_argument('--certfile', help='serve HTTPS with this certificate chain')
+    parser.add_argument('--keyfile', help='private key of the certificate')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='skip the Alexa request signature checks')
+    args = parser.parse_args()
+
+    try:
+        server = SkillHTTPServer((args.host, args.port), verify=not args.no_verify,
+                                 threads=args.threads, keep_alive=args.keep_alive)
+    except ImportError as error:
+        parser.error(str(error))
+    if args.certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(args.certfile, args.keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    if args.no_verify:
+        logger.warning('Alexa request signatures are not verified, do not expose this server')
+
+    logger.info(f'Serving the skill on {args.host}:{args.port}, {args.workers} worker(s) '
+                f'of {args.threads} threads')
+    serve(server, args.workers)
+
+
+if __name__ == '__main__':
+    main()
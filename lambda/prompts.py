@@ -6,6 +6,7 @@ ERROR_ACOUSTIC = "ERROR_ACOUSTIC"
 ERROR_CONFIG = "ERROR_CONFIG"
 ERROR_SPECIFIC_DATE = "ERROR_SPECIFIC_DATE"
 HELP_MESSAGE = "HELP_MESSAGE"
+NO_NOTIFICATION = "NO_NOTIFICATION"
 OKAY = "OKAY"
 STRING = "STRING"
 SELECTED = "SELECTED"